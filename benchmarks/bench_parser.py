@@ -0,0 +1,106 @@
+"""
+Compare the original full-document html.parser path against `parse_html` with strainers.
+The strained extraction must give the same text with lxml and html.parser.
+
+    python -m benchmarks.bench_parser [-n ROUNDS]
+"""
+import argparse
+import os
+import time
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+from concierge.scraper.mk import book_info_style, category_menu_style
+from concierge.scraper.parser import html_parser, parse_html
+
+fixture_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# (fixture, original extractor, strained extractor taking the parser backend)
+cases = [
+    ('mk/index.html',
+     lambda c: BeautifulSoup(c, features='html.parser').find('div', attrs={'style': category_menu_style}),
+     lambda c, f=None: parse_html(c, features=f, parse_only=SoupStrainer('div', attrs={'style': category_menu_style})).find('div')),
+    ('mk/classlist.html',
+     lambda c: BeautifulSoup(c, features='html.parser').find('div', class_='bodybox'),
+     lambda c, f=None: parse_html(c, features=f, parse_only=SoupStrainer('div', attrs={'class': 'bodybox'})).find('div', class_='bodybox')),
+    ('mk/guidebook.html',
+     lambda c: BeautifulSoup(c, features='html.parser').find('div', attrs={'style': book_info_style}),
+     lambda c, f=None: parse_html(c, features=f, parse_only=SoupStrainer('div', attrs={'style': book_info_style})).find('div')),
+    ('mk/audio_index.html',
+     lambda c: BeautifulSoup(c, features='html.parser').find_all('a'),
+     lambda c, f=None: parse_html(c, features=f, parse_only=SoupStrainer('a')).find_all('a')),
+    ('asahi/article.html',
+     lambda c: BeautifulSoup(c, features='html.parser').find('main'),
+     lambda c, f=None: parse_html(c, features=f, parse_only=SoupStrainer('main')).find('main')),
+    ('yomiuri/editorial.html',
+     lambda c: BeautifulSoup(c, features='html.parser').find('div', class_='uni-news-editorial-jp'),
+     lambda c, f=None: parse_html(c, features=f, parse_only=SoupStrainer('div', attrs={'class': 'uni-news-editorial-jp'}))),
+    ('yomiuri/article.html',
+     lambda c: BeautifulSoup(c, features='html.parser').find('article'),
+     lambda c, f=None: parse_html(c, features=f, parse_only=SoupStrainer('article')).find('article')),
+    ('guardian/article.html',
+     lambda c: BeautifulSoup(c, features='html.parser').find('article'),
+     lambda c, f=None: parse_html(c, features=f, parse_only=SoupStrainer('article')).find('article')),
+    ('new_yorker/article.html',
+     lambda c: BeautifulSoup(c, features='html.parser').find('article'),
+     lambda c, f=None: parse_html(c, features=f, parse_only=SoupStrainer('article')).find('article')),
+]
+
+
+def _load(name: str) -> bytes:
+    with open(os.path.join(fixture_dir, name), 'rb') as f:
+        return f.read().replace(b'__BASE__', b'http://localhost')
+
+
+def _text(found) -> str:
+    if isinstance(found, list):
+        return '\n'.join(_text(f) for f in found)
+    return found.get_text()
+
+
+def _check_backends(name: str, strained, content: bytes) -> None:
+    """
+    Fail when lxml and html.parser extract different text, as that would change the article content.
+    """
+    try:
+        import lxml  # noqa: F401
+    except ImportError:
+        print('{0}: lxml is not installed, backends not compared.'.format(name))
+        return
+    texts = {features: _text(strained(content, features)) for features in ('lxml', 'html.parser')}
+    if texts['lxml'] != texts['html.parser']:
+        raise SystemExit('{0}: lxml and html.parser extract different text'.format(name))
+
+
+def _time(fn, content: bytes, rounds: int) -> float:
+    fn(content)  # warm up
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn(content)
+    return (time.perf_counter() - start) / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-n', '--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    print('backend: {0}'.format(html_parser))
+    print('{0:<26}{1:>12}{2:>12}{3:>10}'.format('fixture', 'original ms', 'strained ms', 'speedup'))
+    total_old = total_new = 0.0
+    for name, original, strained in cases:
+        content = _load(name)
+        if original(content) is None or strained(content) is None:
+            raise SystemExit('{0}: extractor found nothing'.format(name))
+        _check_backends(name, strained, content)
+        old = _time(original, content, args.rounds)
+        new = _time(strained, content, args.rounds)
+        total_old += old
+        total_new += new
+        print('{0:<26}{1:>12.2f}{2:>12.2f}{3:>9.1f}x'.format(name, old * 1000, new * 1000, old / new))
+    print('{0:<26}{1:>12.2f}{2:>12.2f}{3:>9.1f}x'.format('total', total_old * 1000, total_new * 1000,
+                                                         total_old / total_new))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Startup cost of the concierge entry point, measured in fresh interpreters.
+
+    python -m benchmarks.bench_startup [-n ROUNDS]
+
+The eager scenarios import every scraper and storage module up front,
+which is what the package did at import time before the lazy registries.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# import names of the Pipfile [packages]. keep in sync when a dependency is added or removed.
+heavy_modules = ('requests', 'bs4', 'dropbox', 'tqdm', 'yaml', 'jinja2', 'feedparser', 'pytz',
+                 'cryptography', 'lxml')
+
+eager = ('import concierge.scraper.mk, concierge.scraper.asahi, concierge.scraper.yomiuri, '
+         'concierge.scraper.new_yorker, concierge.scraper.guardian, concierge.storage.local, '
+         'concierge.storage.dropbox; concierge.scraper.common.get_template_loader()\n')
+
+asahi_only = ('from concierge import app\n'
+              'app.initialize()\n')
+
+scenarios = [
+    ('import concierge', 'import concierge\n'),
+    ('import concierge (eager)', 'import concierge\n' + eager),
+    ('asahi only initialize', asahi_only),
+    ('asahi only initialize (eager)', eager + asahi_only),
+]
+
+probe = '''
+import sys, time
+start = time.perf_counter()
+{0}
+elapsed = time.perf_counter() - start
+import json
+print(json.dumps({{'seconds': elapsed, 'modules': [m for m in {1!r} if m in sys.modules]}}))
+'''
+
+
+def _run(code: str, env: dict) -> dict:
+    p = subprocess.run([sys.executable, '-c', probe.format(code, heavy_modules)], env=env,
+                       stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    if p.returncode:
+        raise SystemExit('probe failed:\n{0}'.format(code))
+    return json.loads(p.stdout.decode('utf-8').strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-n', '--rounds', type=int, default=10)
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix='pdfc-startup-')
+    env = dict(os.environ, PDFC_STORAGE='local', PDFC_USE_HISTORY='false', PDFC_ASAHI='true',
+               PDFC_WORK_DIR=os.path.join(scratch, 'work'), PDFC_CACHE_DIR=os.path.join(scratch, 'cache'),
+               PYTHONPATH=os.pathsep.join(filter(None, [os.getcwd(), os.environ.get('PYTHONPATH')])))
+    for name in ('PDFC_MK_ID', 'PDFC_YOMIURI', 'PDFC_THE_NEW_YORKER', 'PDFC_THE_GUARDIAN'):
+        env.pop(name, None)
+
+    print('{0:<32}{1:>10}{2:>10}  {3}'.format('scenario', 'p50 ms', 'min ms', 'heavy modules loaded'))
+    for name, code in scenarios:
+        runs = [_run(code, env) for _ in range(args.rounds)]
+        seconds = [r['seconds'] for r in runs]
+        print('{0:<32}{1:>10.1f}{2:>10.1f}  {3}'.format(name, statistics.median(seconds) * 1000, min(seconds) * 1000,
+                                                          ', '.join(runs[-1]['modules']) or '-'))
+
+
+if __name__ == '__main__':
+    main()
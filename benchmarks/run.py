@@ -0,0 +1,225 @@
+"""
+End-to-end benchmark of PDFConcierge.execute against the local stub.
+
+    python -m benchmarks.run [--rounds N] [--sources mk,asahi,yomiuri,new-yorker,guardian] [--warm]
+
+Each round runs in a fresh process with its own work and cache directories
+(kept across rounds with --warm), so peak RSS and caches do not leak between rounds.
+"""
+import argparse
+import functools
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sources = ('mk', 'asahi', 'yomiuri', 'new-yorker', 'guardian')
+source_env = {'mk': 'PDFC_MK_ID', 'asahi': 'PDFC_ASAHI', 'yomiuri': 'PDFC_YOMIURI',
+              'new-yorker': 'PDFC_THE_NEW_YORKER', 'guardian': 'PDFC_THE_GUARDIAN'}
+
+
+class StageTimer:
+    def __init__(self):
+        """
+        Wall time of wrapped calls by stage. Stages may nest, e.g. fetch includes parse.
+        """
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+    def wrap(self, owner, name: str, stage: str):
+        fn = getattr(owner, name)
+
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start)
+        setattr(owner, name, timed)
+
+
+def _instrument(timer: StageTimer):
+    from concierge.concierge import PDFConcierge
+    from concierge.storage import Storage
+    from concierge.scraper import asahi, guardian, mk, new_yorker, yomiuri, render
+
+    timer.wrap(PDFConcierge, 'initialize', 'initialize')
+    timer.wrap(PDFConcierge, '_upload_files', 'upload')
+    timer.wrap(Storage, 'fetch_history', 'history fetch')
+    timer.wrap(Storage, 'push_history', 'history push')
+    timer.wrap(mk.MkScraper, '_login', 'login')
+    for name in ('_digest_book_scrap', '_digest_all_book_scrap', '_digest_new_audiobook_scrap',
+                 '_digest_all_audiobook_scrap'):
+        timer.wrap(mk.MkScraper, name, 'listing')
+    timer.wrap(mk.MkScraper, '_fetch_book_page', 'fetch')
+    timer.wrap(mk.MkScraper, '_download_book', 'download')
+    timer.wrap(mk.MkScraper, '_download_audiobook', 'download')
+    timer.wrap(mk.MKAudiobook, 'id3_tag', 'id3')
+    for module, scraper, editorial in ((asahi, 'AsahiScraper', 'AsahiEditorial'),
+                                       (yomiuri, 'YomiuriScraper', 'YomiuriEditorial'),
+                                       (new_yorker, 'NewYorkerScraper', 'NewYorkerEditorial'),
+                                       (guardian, 'GuardianScraper', 'GuardianEditorial')):
+        timer.wrap(getattr(module, scraper), 'list_items', 'listing')
+        timer.wrap(getattr(module, scraper), 'fetch', 'fetch')
+        timer.wrap(getattr(module, editorial), '_render_html', 'jinja render')
+    for module in (asahi, guardian, mk, new_yorker, yomiuri):
+        timer.wrap(module, 'parse_html', 'parse')
+    timer.wrap(render.RenderService, '_render_batch', 'pdf render')
+
+
+def _stand_in_renderer(directory: str) -> str:
+    """
+    wkhtmltopdf replacement that writes a small PDF per stdin line,
+    for hosts without wkhtmltopdf. The pdf render stage is then not meaningful.
+    """
+    path = os.path.join(directory, 'wkhtmltopdf')
+    with open(path, 'w') as f:
+        f.write('#!{0}\n'
+                'import sys\n'
+                'from benchmarks.stub import make_pdf\n'
+                'for line in sys.stdin:\n'
+                '    parts = line.split()\n'
+                '    if len(parts) >= 2:\n'
+                '        open(parts[-1], "wb").write(make_pdf(64 * 1024))\n'
+                'if len(sys.argv) > 1 and sys.argv[-1].endswith(".pdf"):\n'
+                '    open(sys.argv[-1], "wb").write(make_pdf(64 * 1024))\n'.format(sys.executable))
+    os.chmod(path, 0o755)
+    return path
+
+
+def child(args):
+    """
+    One round in this process. Prints a JSON report on the last stdout line.
+    """
+    from benchmarks.stub import Stub, route_to_stub
+
+    stub = Stub(book_pages=args.book_pages, audio_size=args.audio_kb * 1024, book_size=args.book_kb * 1024,
+                latency=args.latency / 1000).start()
+    route_to_stub(stub.address)
+    timer = StageTimer()
+    _instrument(timer)
+
+    from concierge.concierge import PDFConcierge
+    app = PDFConcierge()
+    start = time.perf_counter()
+    try:
+        app.execute()
+    except SystemExit:
+        pass
+    elapsed = time.perf_counter() - start
+    stub.stop()
+
+    uploads = [p for p in stub.dropbox.files if not p.startswith('/data/')]
+    report = {
+        'elapsed': elapsed,
+        'stages': timer.samples,
+        'files': len(uploads),
+        'bytes': sum(len(stub.dropbox.files[p][1]) for p in uploads),
+        'requests': stub.requests,
+        'rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'children_rss_kb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    }
+    print(json.dumps(report))
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = (len(values) - 1) * q
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def _print_report(reports: list, stand_in: bool):
+    stages = {}
+    for r in reports:
+        for stage, samples in r['stages'].items():
+            stages.setdefault(stage, []).extend(samples)
+    print('{0:<16}{1:>7}{2:>11}{3:>10}{4:>10}{5:>10}{6:>10}'.format(
+        'stage', 'calls', 'total s', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms'))
+    for stage, samples in sorted(stages.items(), key=lambda s: -sum(s[1])):
+        print('{0:<16}{1:>7}{2:>11.3f}{3:>10.1f}{4:>10.1f}{5:>10.1f}{6:>10.1f}'.format(
+            stage + (' *' if stage == 'pdf render' and stand_in else ''), len(samples), sum(samples),
+            percentile(samples, .5) * 1000, percentile(samples, .9) * 1000, percentile(samples, .99) * 1000,
+            max(samples) * 1000))
+    elapsed = [r['elapsed'] for r in reports]
+    files = sum(r['files'] for r in reports)
+    total = sum(elapsed)
+    print()
+    print('rounds          {0}'.format(len(reports)))
+    print('run time        p50 {0:.2f}s  p90 {1:.2f}s  max {2:.2f}s'.format(
+        percentile(elapsed, .5), percentile(elapsed, .9), max(elapsed)))
+    print('throughput      {0:.2f} files/s  {1:.2f} MB/s  ({2} files, {3} requests per round)'.format(
+        files / total, sum(r['bytes'] for r in reports) / total / 1024 / 1024,
+        reports[-1]['files'], reports[-1]['requests']))
+    print('peak rss        {0:.1f} MB  (children {1:.1f} MB)'.format(
+        max(r['rss_kb'] for r in reports) / 1024, max(r['children_rss_kb'] for r in reports) / 1024))
+    if stand_in:
+        print('* wkhtmltopdf not found. pdf render used a stand-in writer.')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-n', '--rounds', type=int, default=3)
+    parser.add_argument('--sources', default=','.join(sources))
+    parser.add_argument('--mode', default='new', choices=('new', 'all'))
+    parser.add_argument('--warm', action='store_true', help='keep work and cache directories across rounds.')
+    parser.add_argument('--book-pages', type=int, default=2, help='pages per MK book list.')
+    parser.add_argument('--book-kb', type=int, default=512)
+    parser.add_argument('--audio-kb', type=int, default=2048)
+    parser.add_argument('--latency', type=float, default=0, help='ms added to every stub response.')
+    parser.add_argument('--host-rate', type=float, default=0,
+                        help='requests per second per host (PDFC_HTTP_HOST_RATE). 0, the default here, is unlimited.')
+    parser.add_argument('-v', '--verbose', action='store_true', help='show concierge logs.')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args)
+
+    enabled = [s.strip() for s in args.sources.split(',') if s.strip()]
+    scratch = tempfile.mkdtemp(prefix='pdfc-bench-')
+    env = dict(os.environ, PDFC_MODE=args.mode, PDFC_STORAGE='dropbox', PDFC_CLOUD_TOKEN='bench',
+               PDFC_USE_HISTORY='true', PDFC_PDF_FORMAT='pass-through', PDFC_MK_PW='bench',
+               PDFC_HTTP_HOST_RATE=str(args.host_rate),
+               PYTHONPATH=os.pathsep.join(filter(None, [os.getcwd(), os.environ.get('PYTHONPATH')])))
+    for source in sources:
+        env.pop(source_env[source], None)
+    for source in enabled:
+        env[source_env[source]] = 'bench' if source == 'mk' else 'true'
+    stand_in = not (env.get('PDFC_WKHTMLTOPDF') or shutil.which('wkhtmltopdf'))
+    if stand_in:
+        env['PDFC_WKHTMLTOPDF'] = _stand_in_renderer(scratch)
+    child_args = [a for a in sys.argv[1:]] + ['--child']
+    reports = []
+    try:
+        for i in range(args.rounds):
+            round_dir = os.path.join(scratch, 'shared' if args.warm else str(i))
+            env['PDFC_WORK_DIR'] = os.path.join(round_dir, 'work')
+            env['PDFC_CACHE_DIR'] = os.path.join(round_dir, 'cache')
+            p = subprocess.run([sys.executable, '-m', 'benchmarks.run'] + child_args, env=env,
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL if not args.verbose else None)
+            lines = p.stdout.decode('utf-8').strip().splitlines()
+            if p.returncode or not lines:
+                raise SystemExit('round {0} failed with exit code {1}'.format(i, p.returncode))
+            reports.append(json.loads(lines[-1]))
+            print('round {0}: {1:.2f}s, {2} files'.format(i, reports[-1]['elapsed'], reports[-1]['files']))
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    print()
+    _print_report(reports, stand_in)
+
+
+if __name__ == '__main__':
+    main()
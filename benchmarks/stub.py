@@ -0,0 +1,344 @@
+"""
+Local stub of every remote the concierge talks to.
+
+Requests reach it as http://127.0.0.1:<port>/<scheme>/<host>/<path> (see `route_to_stub`)
+and are answered from the fixtures, with a fake Dropbox API keeping uploads in memory.
+"""
+import email.utils
+import hashlib
+import json
+import os
+import re
+import struct
+import threading
+import uuid
+import zlib
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import pytz
+import requests.adapters
+
+fixture_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def _fixture(name: str) -> str:
+    with open(os.path.join(fixture_dir, name), 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def make_mp3(size: int) -> bytes:
+    """
+    Silent MPEG-1 Layer III stream, 128 kbps / 44.1 kHz, behind an encoder's ID3v2.4 tag.
+    """
+    frame = b'\xff\xfb\x90\x64' + b'\x00' * 413
+    tag = b'ID3\x04\x00\x00\x00\x00\x01\x00' + b'TSSE\x00\x00\x00\x0b\x00\x00\x03Lavf58.76\x00' + b'\x00' * 107
+    return tag + frame * max(1, size // len(frame))
+
+
+def make_pdf(size: int) -> bytes:
+    head = b'%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n' \
+           b'2 0 obj<</Type/Pages/Kids[3 0 R]/Count 1>>endobj\n' \
+           b'3 0 obj<</Type/Page/Parent 2 0 R/MediaBox[0 0 612 792]>>endobj\n'
+    tail = b'trailer<</Root 1 0 R>>\n%%EOF\n'
+    return head + b'%' + b'0' * max(0, size - len(head) - len(tail) - 2) + b'\n' + tail
+
+
+def make_png(width: int, height: int) -> bytes:
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    row = b'\x00' + bytes((x * 7) % 256 for x in range(width * 3))
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) \
+        + chunk(b'IDAT', zlib.compress(row * height)) + chunk(b'IEND', b'')
+
+
+gif = b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04\x01\x00\x00\x00\x00' \
+      b',\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;'
+
+
+def dropbox_content_hash(data: bytes) -> str:
+    block = 4 * 1024 * 1024
+    return hashlib.sha256(b''.join(hashlib.sha256(data[i:i + block]).digest()
+                                   for i in range(0, max(len(data), 1), block))).hexdigest()
+
+
+class FakeDropbox:
+    def __init__(self):
+        """
+        In-memory Dropbox: files by lower-cased path and open upload sessions.
+        """
+        self.files = {}
+        self.sessions = {}
+        self.uploaded_bytes = 0
+        self._lock = threading.Lock()
+
+    def metadata(self, path: str, tag: bool = True) -> dict:
+        data = self.files[path.lower()][1]
+        meta = {'name': path.rsplit('/', 1)[-1], 'id': 'id:' + hashlib.md5(path.lower().encode()).hexdigest()[:22],
+                'client_modified': '2026-01-01T00:00:00Z', 'server_modified': '2026-01-01T00:00:00Z',
+                'rev': '0123456789abcdef', 'size': len(data), 'path_lower': path.lower(), 'path_display': path,
+                'content_hash': dropbox_content_hash(data)}
+        if tag:
+            meta['.tag'] = 'file'
+        return meta
+
+    def put(self, path: str, data: bytes) -> dict:
+        with self._lock:
+            self.files[path.lower()] = (path, data)
+            self.uploaded_bytes += len(data)
+        return self.metadata(path, tag=False)
+
+    def list_folder(self, folder: str):
+        folder = folder.lower().rstrip('/') + '/'
+        with self._lock:
+            paths = [p for p in self.files if p.startswith(folder) and '/' not in p[len(folder):]]
+            return [self.metadata(self.files[p][0]) for p in sorted(paths)]
+
+    def start(self, data: bytes) -> str:
+        session_id = uuid.uuid4().hex
+        with self._lock:
+            self.sessions[session_id] = bytearray(data)
+        return session_id
+
+    def append(self, session_id: str, offset: int, data: bytes) -> bool:
+        with self._lock:
+            buf = self.sessions.get(session_id)
+            if buf is None or len(buf) != offset:
+                return False
+            buf.extend(data)
+            return True
+
+    def finish(self, session_id: str, path: str) -> dict:
+        with self._lock:
+            data = bytes(self.sessions.pop(session_id))
+        return self.put(path, data)
+
+
+class Stub:
+    def __init__(self, book_pages: int = 2, audio_size: int = 2 * 1024 * 1024, book_size: int = 512 * 1024,
+                 latency: float = 0):
+        """
+
+        :param book_pages: pages served for each MK book list.
+        :param audio_size: bytes per audiobook MP3.
+        :param book_size: bytes per MK PDF.
+        :param latency: seconds added to every response.
+        """
+        self.book_pages = book_pages
+        self.audio = make_mp3(audio_size)
+        self.book = make_pdf(book_size)
+        self.png = make_png(640, 360)
+        self.latency = latency
+        self.dropbox = FakeDropbox()
+        self.requests = 0
+        self.logins = 0
+        self.server = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def address(self) -> str:
+        return 'http://127.0.0.1:{0}'.format(self.server.server_address[1])
+
+    def start(self):
+        stub = self
+
+        class Handler(_Handler):
+            pass
+        Handler.stub = stub
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @staticmethod
+    def _substitute(text: str, origin: str, item: str = '') -> str:
+        tokyo = datetime.now(pytz.timezone('Asia/Tokyo'))
+        return text.replace('__BASE__', origin) \
+            .replace('__ITEM__', item) \
+            .replace('__DATE_TODAY__', tokyo.date().isoformat()) \
+            .replace('__DATE_PAST__', '2026-01-01') \
+            .replace('__ASAHI_TODAY__', tokyo.strftime('%Y%m%d%H%M%S')) \
+            .replace('__RSS_NOW__', email.utils.formatdate(usegmt=True))
+
+    def _book_list(self, origin: str, query: dict) -> str:
+        page = int(query.get('page', ['1'])[0])
+        code = int(re.sub(r'\D', '', query.get('code', query.get('gubun', ['0']))[0]) or 0)
+        offset = code * 100000 + (page - 1) * 100
+        html = _fixture('mk/classlist.html')
+        html = re.sub(r'book_sno=(\d+)', lambda m: 'book_sno={0}'.format(int(m.group(1)) + offset), html)
+        html = re.sub(r'<a href="[^"]*page=(\d+)">\d+</a>',
+                      lambda m: m.group(0) if int(m.group(1)) <= self.book_pages else '', html)
+        return self._substitute(html, origin)
+
+    def route(self, method: str, scheme: str, host: str, path: str, query: dict, headers, body: bytes):
+        """
+
+        :return: (status, headers, body)
+        """
+        origin = '{0}://{1}'.format(scheme, host)
+        html = {'Content-Type': 'text/html; charset=utf-8'}
+        if host in ('api.dropboxapi.com', 'content.dropboxapi.com'):
+            return self._dropbox(path, headers, body)
+        if host == 'member.mk.co.kr':
+            if path == '/member_login_process.php':
+                with self._lock:
+                    self.logins += 1
+            return 200, dict(html, **{'Set-Cookie': 'mk_member=bench; Domain=.mk.co.kr; Path=/'}), \
+                b'<html><body>ok</body></html>'
+        if host == 'digest.mk.co.kr':
+            lower = path.lower()
+            if lower == '/main/index.asp' and 'mk_member=bench' in (headers.get('Cookie') or ''):
+                return 200, html, '<html><body><a href="/logout.asp">로그아웃</a></body></html>'.encode('utf-8')
+            if lower == '/main/index.asp':
+                return 200, html, b'<html><body><form action="https://member.mk.co.kr/member_login_process.php">' \
+                                  b'<input name="user_id"><input type="password" name="password"></form></body></html>'
+            if lower in ('/loginaction.asp', '/sub/notice.asp'):
+                return 200, html, b'<html><body>ok</body></html>'
+            if lower == '/sub/digest/index.asp':
+                return 200, html, self._substitute(_fixture('mk/index.html'), origin).encode('utf-8')
+            if lower == '/sub/audio/index.asp':
+                return 200, html, self._substitute(_fixture('mk/audio_index.html'), origin).encode('utf-8')
+            if lower in ('/sub/digest/newbooklist.asp', '/sub/digest/classlist.asp', '/sub/audio/classlist.asp'):
+                return 200, html, self._book_list(origin, query).encode('utf-8')
+            if lower == '/sub/digest/guidebook.asp':
+                item = query.get('book_sno', [''])[0]
+                return 200, html, self._substitute(_fixture('mk/guidebook.html'), origin, item).encode('utf-8')
+            if lower == '/sub/digest/download.asp':
+                book_id = parse_qs(body.decode('ascii')).get('book_sno', ['0'])[0]
+                filename = '요약 도서 {0}.pdf'.format(book_id).encode('cp949').decode('iso-8859-1')
+                return 200, {'Content-Type': 'application/pdf',
+                             'Content-Disposition': 'attachment; filename={0}'.format(filename)}, self.book
+            if lower.startswith('/book_img/'):
+                return 200, {'Content-Type': 'image/gif', 'ETag': '"thumb"'}, gif
+        if host == 'www.bcaudio.co.kr' and path.startswith('/audio/'):
+            return 200, {'Content-Type': 'audio/mpeg'}, self.audio
+        if path.startswith('/images/'):
+            return 200, {'Content-Type': 'image/png', 'ETag': '"figure"'}, self.png
+        fixtures = {
+            ('www.asahicom.jp', '/rensai/json/da16.json'): ('asahi/da16.json', 'application/json'),
+            ('www.yomiuri.co.jp', '/editorial'): ('yomiuri/editorial.html', 'text/html; charset=utf-8'),
+            ('www.theguardian.com', '/profile/editorial/rss'): ('guardian/rss.xml', 'application/rss+xml'),
+            ('www.newyorker.com', '/feed/news/daily-comment'): ('new_yorker/rss.xml', 'application/rss+xml'),
+        }
+        if (host, path) in fixtures:
+            name, content_type = fixtures[(host, path)]
+            return 200, {'Content-Type': content_type}, self._substitute(_fixture(name), origin).encode('utf-8')
+        articles = {'www.asahi.com': 'asahi/article.html', 'www.yomiuri.co.jp': 'yomiuri/article.html',
+                    'www.theguardian.com': 'guardian/article.html', 'www.newyorker.com': 'new_yorker/article.html'}
+        if host in articles:
+            item = path.rstrip('/').rsplit('/', 1)[-1].split('.')[0]
+            return 200, html, self._substitute(_fixture(articles[host]), origin, item).encode('utf-8')
+        return 404, html, b'not found'
+
+    def _dropbox(self, path: str, headers, body: bytes):
+        box = self.dropbox
+        route = path[len('/2/'):]
+        as_json = {'Content-Type': 'application/json'}
+        arg = json.loads(headers.get('Dropbox-API-Arg') or (body.decode('utf-8') if body else 'null') or 'null')
+
+        def ok(result):
+            return 200, as_json, json.dumps(result).encode('utf-8')
+
+        def not_found(tag):
+            error = {'.tag': tag, tag: {'.tag': 'not_found'}}
+            return 409, as_json, json.dumps({'error_summary': '{0}/not_found/.'.format(tag),
+                                             'error': error}).encode('utf-8')
+        if route == 'check/user':
+            return ok({'result': arg['query']})
+        if route in ('files/list_folder', 'files/list_folder/continue'):
+            folder = arg.get('path') or arg.get('cursor')
+            entries = box.list_folder(folder)
+            if not entries:
+                return not_found('path')
+            return ok({'entries': entries, 'cursor': folder, 'has_more': False})
+        if route == 'files/upload':
+            return ok(box.put(arg['path'], body))
+        if route == 'files/upload_session/start':
+            return ok({'session_id': box.start(body)})
+        if route == 'files/upload_session/append_v2':
+            if not box.append(arg['cursor']['session_id'], arg['cursor']['offset'], body):
+                return 409, as_json, json.dumps({'error_summary': 'incorrect_offset/.',
+                                                 'error': {'.tag': 'not_found'}}).encode('utf-8')
+            return ok(None)
+        if route == 'files/upload_session/finish':
+            box.append(arg['cursor']['session_id'], arg['cursor']['offset'], body)
+            return ok(box.finish(arg['cursor']['session_id'], arg['commit']['path']))
+        if route == 'files/upload_session/finish_batch':
+            entries = [dict(box.finish(e['cursor']['session_id'], e['commit']['path']), **{'.tag': 'success'})
+                       for e in arg['entries']]
+            return ok({'.tag': 'complete', 'entries': entries})
+        if route == 'files/download':
+            if arg['path'].lower() not in box.files:
+                return not_found('path')
+            meta = box.metadata(arg['path'], tag=False)
+            return 200, {'Content-Type': 'application/octet-stream',
+                         'Dropbox-API-Result': json.dumps(meta)}, box.files[arg['path'].lower()][1]
+        if route == 'files/delete_v2':
+            if arg['path'].lower() not in box.files:
+                return not_found('path_lookup')
+            meta = box.metadata(arg['path'])
+            with box._lock:
+                box.files.pop(arg['path'].lower(), None)
+            return ok({'metadata': meta})
+        return 400, {'Content-Type': 'text/plain'}, 'unsupported route {0}'.format(route).encode('utf-8')
+
+
+class _Handler(BaseHTTPRequestHandler):
+    stub = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        parts = urlsplit(self.path)
+        _, scheme, host, path = (parts.path.split('/', 3) + [''])[:4]
+        with self.stub._lock:
+            self.stub.requests += 1
+        if self.stub.latency:
+            threading.Event().wait(self.stub.latency)
+        status, headers, payload = self.stub.route(self.command, scheme, host, '/' + path,
+                                                   parse_qs(parts.query), self.headers, body)
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(payload)
+
+    do_GET = do_POST = do_HEAD = _handle
+
+
+def route_to_stub(address: str):
+    """
+    Send every request of every requests.Session in this process to the stub,
+    including the sessions dropbox and the scrapers create themselves.
+
+    :param address: stub base url.
+    """
+    send = requests.adapters.HTTPAdapter.send
+
+    def stub_send(adapter, request, *args, **kwargs):
+        url = request.url
+        if url.startswith(address):
+            return send(adapter, request, *args, **kwargs)
+        parts = urlsplit(url)
+        request.url = '{0}/{1}/{2}{3}'.format(address, parts.scheme, parts.netloc,
+                                              parts.path + ('?' + parts.query if parts.query else ''))
+        try:
+            r = send(adapter, request, *args, **kwargs)
+        finally:
+            request.url = url  # cookies are extracted against the original host
+        r.url = url
+        return r
+    requests.adapters.HTTPAdapter.send = stub_send
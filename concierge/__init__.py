@@ -5,4 +5,9 @@
 
 __version__ = '0.5'
 
-from .concierge import app
+
+def __getattr__(name):
+    if name == 'app':
+        from .concierge import app
+        return app
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
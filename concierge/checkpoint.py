@@ -0,0 +1,152 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+from .logger import get_logger
+
+
+class Checkpoint:
+    # 'dropped' closes a record whose work files are gone.
+    stages = ('downloaded', 'converted', 'uploaded', 'dropped')
+
+    def __init__(self, path=None, max_age: float = 0):
+        """
+        Durable per-item progress journal, so a crashed run can resume.
+        Every `mark` is appended as a JSON line and fsync-ed.
+        Without `path` the journal only lives in memory.
+
+        :param path: journal file. work files are kept next to it, the directory belongs to the checkpoint.
+        :param max_age: seconds after which an unfinished download and unreferenced work files are removed
+                        by `finish`. 0 keeps them.
+        """
+        self.logger = get_logger(__name__)
+        self.path = path
+        self.max_age = max_age
+        self._records = {}
+        self._lock = threading.Lock()
+        if path:
+            self.work_dir = os.path.dirname(os.path.abspath(path))
+            os.makedirs(self.work_dir, exist_ok=True)
+            self._load()
+        else:
+            self.work_dir = tempfile.mkdtemp(prefix='pdfc-')
+
+    @staticmethod
+    def _key(source, kind, item_id) -> str:
+        return '{0}/{1}/{2}'.format(source, kind, item_id)
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # torn write of the last line
+                    self._records[record['key']] = record
+        except OSError:
+            return
+        if self._records:
+            self.logger.info('resume from checkpoint. {0} items recorded.'.format(len(self._records)))
+
+    def _append(self, records):
+        if not self.path:
+            return
+        with open(self.path, 'a') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def work_path(self, name) -> str:
+        return os.path.join(self.work_dir, name)
+
+    def get(self, source, kind, item_id):
+        """
+
+        :return: latest record of the item or None
+        """
+        return self._records.get(self._key(source, kind, item_id))
+
+    def records(self, source, stage=None) -> list:
+        """
+
+        :param source:
+        :param stage: only records at this stage when given.
+        :return: [(kind, item_id, record), ...] of the source
+        """
+        prefix = source + '/'
+        with self._lock:
+            return [tuple(k[len(prefix):].split('/', 1)) + (v,) for k, v in self._records.items()
+                    if k.startswith(prefix) and (stage is None or v['stage'] == stage)]
+
+    def mark(self, source, kind, item_id, stage, **info) -> None:
+        record = dict(info, key=self._key(source, kind, item_id), stage=stage)
+        with self._lock:
+            self._records[record['key']] = record
+            self._append([record])
+
+    @staticmethod
+    def _paths(record) -> list:
+        paths = [record['path']] if 'path' in record else []
+        return paths + [r['path'] for r in record.get('results', []) if 'path' in r]
+
+    def _expired(self, path, now) -> bool:
+        try:
+            return now - os.path.getmtime(path) > self.max_age
+        except OSError:
+            return True
+
+    def _remove(self, path) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _prune(self) -> None:
+        """
+        Remove downloads that were not picked up within `max_age`, e.g. items that dropped off the listing,
+        and work files no record refers to, e.g. .part leftovers of abandoned downloads.
+        """
+        now = time.time()
+        for key, record in list(self._records.items()):
+            if record['stage'] == 'downloaded' and self._expired(record['path'], now):
+                self.logger.info('drop stale download {0}.'.format(key))
+                self._remove(record['path'])
+                del self._records[key]
+        referenced = {os.path.abspath(p) for record in self._records.values() for p in self._paths(record)}
+        journal = os.path.abspath(self.path)
+        for entry in os.scandir(self.work_dir):
+            path = os.path.abspath(entry.path)
+            if not entry.is_file() or path in referenced or path in (journal, journal + '.tmp'):
+                continue
+            if self._expired(path, now):
+                self.logger.info('remove stale work file {0}.'.format(entry.name))
+                self._remove(path)
+
+    def finish(self) -> None:
+        """
+        Drop uploaded and dropped items once the run is done, and prune stale work files.
+        Unfinished items are kept for the next run.
+        """
+        with self._lock:
+            self._records = {k: v for k, v in self._records.items() if v['stage'] not in ('uploaded', 'dropped')}
+            if self.path and self.max_age > 0:
+                self._prune()
+            if not self.path:
+                return
+            if self._records:
+                tmp = self.path + '.tmp'
+                with open(tmp, 'w') as f:
+                    for record in self._records.values():
+                        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, self.path)
+            else:
+                try:
+                    os.remove(self.path)
+                except OSError:
+                    pass
@@ -1,16 +1,46 @@
 import os
 import pathlib
+import re
+import signal
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 
+import pytz
+
+from .checkpoint import Checkpoint
+from .config import env_int
 from .logger import get_logger
-from .storage import Storage, LocalStorage
-from .scraper import MkScraper, AsahiScraper, YomiuriScraper, NewYorkerScraper, GuardianScraper
+from .metrics import get_metrics
+from .pipeline import SourceScheduler, UploadQueue
+from .schedule import parse_schedule
+from .storage import load_storage
+from .storage.secret import SecretStore
+from .scraper import available_scrapers, load_scraper
 
 concierge_mode = {
     'new': 'fetch_new',
     'all': 'fetch_all'
 }
 
+# built-in sources enabled by their own variable. any source, plugins included, can be listed in PDFC_SOURCES.
+source_enable_env = {
+    'asahi': 'PDFC_ASAHI',
+    'yomiuri': 'PDFC_YOMIURI',
+    'new-yorker': 'PDFC_THE_NEW_YORKER',
+    'guardian': 'PDFC_THE_GUARDIAN'
+}
+
+source_schedule_env = {
+    'mk': 'PDFC_SCHEDULE_MK',
+    'asahi': 'PDFC_SCHEDULE_ASAHI',
+    'yomiuri': 'PDFC_SCHEDULE_YOMIURI',
+    'new-yorker': 'PDFC_SCHEDULE_THE_NEW_YORKER',
+    'guardian': 'PDFC_SCHEDULE_THE_GUARDIAN'
+}
+
 pdf_format = {
     'a4': 'a4',
     'kindle': 'kindle',
@@ -40,130 +70,302 @@ def pdf_format_mode(mode) -> str:
 class PDFConcierge:
     def __init__(self):
         self.logger = get_logger(__name__)
+        self.metrics = get_metrics()
         self.storage = None
         self.local_storage = None
         self.mk_scraper = None
-        self.asahi_scraper = None
-        self.yomiuri_scraper = None
-        self.new_yorker_scraper = None
-        self.guardian_scraper = None
+        self.scrapers = {}
         self.history_hash = None
         self.mode = concierge_execute_mode(os.environ.get('PDFC_MODE'))
         self.allow_local_backup = is_true(os.environ.get('PDFC_ALLOW_LOCAL_BACKUP'))
         self.pdf_format = pdf_format_mode(os.environ.get('PDFC_PDF_FORMAT'))
         self.use_history = is_true(os.environ.get('PDFC_USE_HISTORY'))
         # self.history_reference = os.environ.get('PDFC_HISTORY_REFERENCE')
+        self.work_dir = os.environ.get('PDFC_WORK_DIR',
+                                       os.path.join(pathlib.Path(__file__).parent.parent.resolve(), 'work'))
+        self.checkpoint = None
         self.storage_type = os.environ.get('PDFC_STORAGE')
         self.storage_token = os.environ.get('PDFC_CLOUD_TOKEN')
         self.mk_id = os.environ.get('PDFC_MK_ID')
         self.mk_pw = os.environ.get('PDFC_MK_PW')
-        self.asahi = os.environ.get('PDFC_ASAHI')
-        self.yomiuri = os.environ.get('PDFC_YOMIURI')
-        self.new_yorker = os.environ.get('PDFC_THE_NEW_YORKER')
-        self.guardian = os.environ.get('PDFC_THE_GUARDIAN')
+        self.mk_reuse_session = is_true(os.environ.get('PDFC_MK_REUSE_SESSION', 'true'))
+        self.session_key = os.environ.get('PDFC_SESSION_KEY') or self.mk_pw
+        self.sources = self._enabled_sources()
+        self.daemon = is_true(os.environ.get('PDFC_DAEMON'))
+        self.default_schedule = os.environ.get('PDFC_SCHEDULE', '1h')
+        self.timezone = pytz.timezone(os.environ.get('PDFC_TIMEZONE', 'UTC'))
+        self._stopping = threading.Event()
+        self._wake = threading.Event()
+        self.max_sources = env_int('PDFC_MAX_SOURCES', 0)
+        self.upload_workers = env_int('PDFC_UPLOAD_WORKERS', 2)
+        self.upload_queue_size = env_int('PDFC_UPLOAD_QUEUE_SIZE', 4)
+        self.upload_batch_size = env_int('PDFC_UPLOAD_BATCH_SIZE', 8)
+        # upload queue of the run each source is part of. runs of different sources may overlap in daemon mode.
+        self._upload_queues = {}
+        self._upload_queues_lock = threading.Lock()
 
     def initialize(self):
         self.storage = self._set_storage()
         self.logger.info('storage type "{0}" initialized.'.format(self.storage.type))
         if self.allow_local_backup and self.storage.type != 'local':
-            self.local_storage = LocalStorage('local', '')
+            self.local_storage = load_storage('local')('local', '')
         if self.use_history:
             self.storage.fetch_history()
             self.logger.info('history data fetched.')
+        self.checkpoint = Checkpoint(os.path.join(self.work_dir, 'checkpoint.jsonl'),
+                                     max_age=env_int('PDFC_WORK_MAX_AGE', 7 * 24 * 3600))
         if self.mk_id:
             self._init_mk()
-        if self.asahi:
-            self._init_asahi()
-        if self.yomiuri:
-            self._init_yomiuri()
-        if self.new_yorker:
-            self._init_new_yorker()
-        if self.guardian:
-            self._init_guardian()
+        for source in self.sources:
+            self._init_source(source)
         self.history_hash = self._make_history_hash()
 
     def _init_mk(self):
         self.logger.info('mk digest initializing...')
-        try:
-            self.storage.history['mk']
-        except KeyError:
-            self.storage.history.update({'mk': {'book': [], 'audiobook': []}})
-        mk_history = self.storage.history['mk']
-        self.mk_scraper = MkScraper(mk_id=self.mk_id, mk_pw=self.mk_pw,
-                                    pdf_format=self.pdf_format, history=mk_history)
+        scraper = load_scraper('mk')
+        mk_history = self.storage.history.stage('mk', scraper.history_kinds)
+        session_store = SecretStore(self.storage, 'mk_session.bin', self.session_key) \
+            if self.mk_reuse_session else None
+        self.mk_scraper = scraper(mk_id=self.mk_id, mk_pw=self.mk_pw,
+                                  pdf_format=self.pdf_format, history=mk_history,
+                                  on_result=self._result_handler('mk'), checkpoint=self.checkpoint,
+                                  session_store=session_store)
+        self.scrapers['mk'] = self.mk_scraper
         self.logger.info('mk digest initialized.')
 
-    def _init_asahi(self):
-        self.asahi_scraper = AsahiScraper(pdf_format=self.pdf_format)
-
-    def _init_yomiuri(self):
-        self.yomiuri_scraper = YomiuriScraper(pdf_format=self.pdf_format)
-
-    def _init_new_yorker(self):
-        self.new_yorker_scraper = NewYorkerScraper(pdf_format=self.pdf_format)
-
-    def _init_guardian(self):
-        self.guardian_scraper = GuardianScraper(pdf_format=self.pdf_format)
+    def _init_source(self, source):
+        try:
+            scraper = load_scraper(source)
+        except ValueError:
+            self.logger.warning('source "{0}" is not installed. skipped. available: {1}'.format(
+                source, ', '.join(sorted(available_scrapers()))))
+            return
+        self.scrapers[source] = scraper(pdf_format=self.pdf_format,
+                                        on_result=self._result_handler(source),
+                                        history=self.storage.history.stage(source, scraper.history_kinds))
 
     def _make_history_hash(self):
-        try:
-            return hash(tuple(frozenset(sorted(self.storage.history.items()))))
-        except TypeError:
-            return hash(tuple(frozenset({}.items())))
+        return len(self.storage.history)
 
     def _history_hash_unmatched(self) -> bool:
         return self.history_hash != self._make_history_hash()
 
     def _set_storage(self):
-        for cls in Storage.__subclasses__():
-            if cls.is_available(self.storage_type):
-                return cls(storage_type=self.storage_type, storage_token=self.storage_token)
-        raise ValueError
+        cls = load_storage(self.storage_type)
+        if not cls.is_available(self.storage_type):
+            raise ValueError
+        return cls(storage_type=self.storage_type, storage_token=self.storage_token)
+
+    def _result_handler(self, source):
+        def handler(filetype, file_result):
+            self._upload_queues[source].put(filetype, dict(file_result, source=source))
+        return handler
 
-    def _upload_to_storage(self, files):
+    def _upload_files(self, files):
+        with self.metrics.timer('upload', storage=self.storage.type):
+            pending = self.storage.exclude_uploaded(files)
+            uploaded = self.storage.upload_batch(pending)
+        failed = [f for f in pending if f not in uploaded]
+        self.metrics.count('uploads', len(uploaded), result='done')
+        self.metrics.count('uploads', len(failed), result='failed')
+        self.metrics.count('uploads', len(files) - len(pending), result='unchanged')
+        for category, file_result in files:
+            if (category, file_result) in failed:
+                continue
+            if 'id' in file_result and 'source' in file_result:
+                # history is recorded only once the file is stored, so a failed upload is fetched again.
+                self.checkpoint.mark(file_result['source'], category, file_result['id'], 'uploaded')
+                self.storage.history.add(file_result['source'], category, file_result['id'])
+            if self.local_storage and not self.local_storage.is_uploaded(category, file_result):
+                self.logger.info('upload to local backup...')
+                self.local_storage.upload(file_result, category)
+            else:
+                try:
+                    os.remove(pathlib.Path(file_result['path']))
+                except OSError:
+                    pass
+
+    def _upload_to_storage(self, source, files):
         for category, v in files.items():
             for file_result in v:
-                self.storage.upload(file_result, category)
-                if self.local_storage:
-                    self.logger.info('upload to local backup...')
-                    self.local_storage.upload(file_result, category)
-                else:
-                    try:
-                        os.remove(pathlib.Path(file_result['path']))
-                    except OSError:
-                        pass
+                self._upload_queues[source].put(category, file_result)
 
     def _send_notice(self):
         pass
 
-    def execute(self):
-        self.initialize()
-        if self.mk_scraper:
-            self.logger.info('fetch from mk digest...')
+    @staticmethod
+    def _enabled_sources() -> list:
+        sources = [source for source, env in source_enable_env.items() if os.environ.get(env)]
+        for source in (os.environ.get('PDFC_SOURCES') or '').split(','):
+            source = source.strip()
+            if source and source != 'mk' and source not in sources:
+                sources.append(source)
+        return sources
+
+    def _enabled_scrapers(self) -> dict:
+        return dict(self.scrapers)
+
+    def _run_mk(self):
+        self.logger.info('fetch from mk digest...')
+        with self.metrics.timer('source', source='mk'):
             files = self.mk_scraper.execute(self.mode)
-            self._upload_to_storage(files)
-            self.storage.history['mk'] = self.mk_scraper.history
-            self.logger.info('fetch from mk digest done.')
-        if self.asahi_scraper:
-            files = self.asahi_scraper.download_editorials()
-            self._upload_to_storage(files)
-        if self.yomiuri_scraper:
-            files = self.yomiuri_scraper.download_editorials()
-            self._upload_to_storage(files)
-        if self.new_yorker_scraper:
-            files = self.new_yorker_scraper.download_editorials()
-            self._upload_to_storage(files)
-        if self.guardian_scraper:
-            files = self.guardian_scraper.download_editorials()
-            self._upload_to_storage(files)
+        self._upload_to_storage('mk', files)
+        self.logger.info('fetch from mk digest done.')
+        return self.mk_scraper.history
+
+    def _run_editorial(self, source, scraper):
+        with self.metrics.timer('source', source=source):
+            files = scraper.download_editorials()
+        self._upload_to_storage(source, files)
+        return scraper.history
+
+    def _merge_history(self, results: dict):
+        for source, histories in results.items():
+            for h in histories:
+                if h is not None:
+                    self.storage.history.merge(source, h)
+
+    def _commit_sources(self, scrapers: dict) -> None:
+        """
+        Commit the listing validators of sources whose items are all stored,
+        so a listing with a failed or lost upload is fetched again next run.
+        """
+        for source, scraper in scrapers.items():
+            if not getattr(scraper, 'complete', False):
+                continue
+            if all(self.storage.history.contains(source, kind, item_id) for kind, item_id in scraper.pushed):
+                scraper.commit()
+            else:
+                self.logger.info('{0}: some uploads failed. the listing is fetched again next run.'.format(source))
+
+    def _reset_scrapers(self, sources) -> None:
+        for source, scraper in self._enabled_scrapers().items():
+            if source in sources:
+                scraper.reset(history=self.storage.history.stage(source, scraper.history_kinds))
+
+    def run_once(self, sources=None, report: bool = True):
+        """
+        One cycle: fetch from the sources, upload, push history.
+        Cycles of different sources may run at the same time, a source must not be in two of them.
+
+        :param sources: source names to run. every enabled source when omitted.
+        :param report: write the run metrics at the end.
+        """
+        scrapers = {k: v for k, v in self._enabled_scrapers().items() if sources is None or k in sources}
+        self._reset_scrapers(scrapers)
+        self.storage.clear_remote_cache()
+        upload_queue = UploadQueue(self._upload_files, workers=self.upload_workers,
+                                   max_pending=self.upload_queue_size, batch_size=self.upload_batch_size)
+        with self._upload_queues_lock:
+            for source in scrapers:
+                self._upload_queues[source] = upload_queue
+        upload_queue.start()
+        scheduler = SourceScheduler(max_workers=self.max_sources)
+        for source, scraper in scrapers.items():
+            if source == 'mk':
+                scheduler.submit(source, self._run_mk)
+            else:
+                scheduler.submit(source, self._run_editorial, source, scraper)
+        results = scheduler.run()
+        upload_queue.close()
+        with self._upload_queues_lock:
+            for source in scrapers:
+                self._upload_queues.pop(source, None)
+        self._commit_sources(scrapers)
+        self._merge_history(results)
         self.logger.info('all task done.')
         if self.use_history:
             self.logger.info('update history data.')
             self.storage.push_history()
+        self.checkpoint.finish()
         if self._history_hash_unmatched():
             self.logger.info('history hash unmatched. send notice.')
             self._send_notice()
+            self.history_hash = self._make_history_hash()
+        if report:
+            self.metrics.observe('run', time.time() - self.metrics.started)
+            self.metrics.report()
+
+    def _schedules(self) -> dict:
+        schedules = {}
+        for source in self._enabled_scrapers():
+            env = source_schedule_env.get(source) or \
+                'PDFC_SCHEDULE_{0}'.format(re.sub(r'[^A-Z0-9]', '_', source.upper()))
+            spec = os.environ.get(env) or self.default_schedule
+            schedules[source] = parse_schedule(spec)
+            self.logger.info('{0} scheduled {1}.'.format(source, schedules[source]))
+        return schedules
+
+    def _now(self) -> datetime:
+        return datetime.now(tz=self.timezone).replace(tzinfo=None)
+
+    def stop(self, *args) -> None:
+        self.logger.info('stop requested. exit after the current cycles.')
+        self._stopping.set()
+        self._wake.set()
+
+    def serve(self):
+        """
+        Stay resident and run each source on its own schedule.
+        Each due source runs as its own cycle, so a slow source does not hold back the others,
+        and a source is not started again while its previous cycle is running.
+        Sessions, history, templates and caches of the first cycle are kept for later ones.
+        Every source runs once at start. Metrics are reported whenever no cycle is running.
+        """
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.stop)
+            signal.signal(signal.SIGINT, self.stop)
+        schedules = self._schedules()
+        if not schedules:
+            self.logger.info('no source enabled.')
+            return
+        next_run = {source: self._now() for source in schedules}
+        running = {}
+        with ThreadPoolExecutor(max_workers=len(schedules), thread_name_prefix='cycle') as executor:
+            while True:
+                self._wake.clear()
+                finished = [source for source, future in running.items() if future.done()]
+                for source in finished:
+                    try:
+                        running.pop(source).result()
+                    except Exception:
+                        self.logger.exception('{0} cycle failed.'.format(source))
+                    next_run[source] = schedules[source].next_after(self._now())
+                    self.logger.info('{0} next run at {1}.'.format(source, next_run[source]))
+                if finished and not running:
+                    self.metrics.observe('run', time.time() - self.metrics.started)
+                    self.metrics.report()
+                if self._stopping.is_set():
+                    if not running:
+                        return
+                    self._wake.wait()
+                    continue
+                now = self._now()
+                for source, at in next_run.items():
+                    if at <= now and source not in running:
+                        self.logger.info('cycle start: {0}'.format(source))
+                        running[source] = executor.submit(self.run_once, [source], report=False)
+                        running[source].add_done_callback(lambda f: self._wake.set())
+                waiting = [at for source, at in next_run.items() if source not in running]
+                self._wake.wait(max(0.0, (min(waiting) - now).total_seconds()) if waiting else None)
+
+    def execute(self):
+        with self.metrics.timer('initialize'):
+            self.initialize()
+        if self.daemon:
+            self.serve()
+        else:
+            self.run_once()
         sys.exit()
 
+_app = None
+
 
-app = PDFConcierge()
+def __getattr__(name):
+    # `app` is built on first access, so importing the package has no side effects.
+    global _app
+    if name == 'app':
+        if _app is None:
+            _app = PDFConcierge()
+        return _app
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
@@ -0,0 +1,27 @@
+import os
+import pathlib
+
+project_root = pathlib.Path(__file__).parent.parent.resolve()
+
+
+def env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def cache_dir(name: str) -> str:
+    """
+    Directory for a local cache, under PDFC_CACHE_DIR (default ./cache).
+    """
+    path = os.path.join(os.environ.get('PDFC_CACHE_DIR', os.path.join(project_root, 'cache')), name)
+    os.makedirs(path, exist_ok=True)
+    return path
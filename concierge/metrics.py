@@ -0,0 +1,178 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from .logger import get_logger
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return (name,) + tuple(sorted(labels.items()))
+
+
+def _prometheus_labels(key: tuple, **extra) -> str:
+    labels = dict(key[1:], **extra)
+    if not labels:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                          for k, v in sorted(labels.items())) + '}'
+
+
+class Metrics:
+    def __init__(self, path: str = None, prometheus_path: str = None):
+        """
+        Per-run stage timings, counters and gauges.
+        Every timing is written as a JSON line to `path` as it happens,
+        `report` adds a summary line, writes the Prometheus textfile and logs a summary table.
+
+        :param path: JSON lines file. appended to.
+        :param prometheus_path: textfile for the node_exporter textfile collector. replaced on every report.
+        """
+        self.logger = get_logger(__name__)
+        self.path = path
+        self.prometheus_path = prometheus_path
+        self._stages = {}
+        self._counters = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+        self._file = None
+        self.started = time.time()
+
+    def _emit(self, record: dict) -> None:
+        if not self.path:
+            return
+        record = dict(record, ts=round(time.time(), 6))
+        with self._lock:
+            if self._file is None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._file.flush()
+
+    @contextmanager
+    def timer(self, stage: str, **labels):
+        """
+        Time the block as one `stage` sample.
+
+        :param stage:
+        :param labels: e.g. source.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, **labels)
+
+    def observe(self, stage: str, seconds: float, **labels) -> None:
+        key = _key(stage, labels)
+        with self._lock:
+            s = self._stages.setdefault(key, [0, 0.0, 0.0])
+            s[0] += 1
+            s[1] += seconds
+            s[2] = max(s[2], seconds)
+        self._emit(dict(labels, type='timer', stage=stage, seconds=round(seconds, 6)))
+
+    def count(self, name: str, value: int = 1, **labels) -> None:
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def gauge(self, name: str, value: float, **labels) -> None:
+        """
+        Record the current value. the summary keeps the last and the max value.
+        """
+        key = _key(name, labels)
+        with self._lock:
+            last, peak = self._gauges.get(key, (value, value))
+            self._gauges[key] = (value, max(peak, value))
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'stages': [dict(k[1:], stage=k[0], count=v[0], seconds=round(v[1], 6), max=round(v[2], 6))
+                           for k, v in sorted(self._stages.items())],
+                'counters': [dict(k[1:], name=k[0], value=v) for k, v in sorted(self._counters.items())],
+                'gauges': [dict(k[1:], name=k[0], last=v[0], max=v[1]) for k, v in sorted(self._gauges.items())],
+            }
+
+    def _write_prometheus(self) -> None:
+        lines = []
+        with self._lock:
+            stages = sorted(self._stages.items())
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+        if stages:
+            lines.append('# TYPE pdfc_stage_seconds summary')
+            for k, v in stages:
+                lines.append('pdfc_stage_seconds_sum{0} {1}'.format(_prometheus_labels(k, stage=k[0]), v[1]))
+                lines.append('pdfc_stage_seconds_count{0} {1}'.format(_prometheus_labels(k, stage=k[0]), v[0]))
+            lines.append('# TYPE pdfc_stage_seconds_max gauge')
+            for k, v in stages:
+                lines.append('pdfc_stage_seconds_max{0} {1}'.format(_prometheus_labels(k, stage=k[0]), v[2]))
+        for name in sorted({k[0] for k, v in counters}):
+            lines.append('# TYPE pdfc_{0}_total counter'.format(name))
+            lines += ['pdfc_{0}_total{1} {2}'.format(name, _prometheus_labels(k), v) for k, v in counters
+                      if k[0] == name]
+        for name in sorted({k[0] for k, v in gauges}):
+            lines.append('# TYPE pdfc_{0}_max gauge'.format(name))
+            lines += ['pdfc_{0}_max{1} {2}'.format(name, _prometheus_labels(k), v[1]) for k, v in gauges
+                      if k[0] == name]
+        lines.append('# TYPE pdfc_last_run_timestamp_seconds gauge')
+        lines.append('pdfc_last_run_timestamp_seconds {0}'.format(time.time()))
+        tmp = '{0}.tmp'.format(self.prometheus_path)
+        with open(tmp, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp, self.prometheus_path)
+
+    def summary(self) -> str:
+        def labels(record, *skip):
+            return ' '.join('{0}={1}'.format(k, v) for k, v in sorted(record.items()) if k not in skip) or '-'
+        snapshot = self.snapshot()
+        rows = ['{0:<16}{1:<32}{2:>7}{3:>11}{4:>10}{5:>10}'.format('stage', 'labels', 'count', 'total s', 'avg ms',
+                                                                   'max ms')]
+        for s in sorted(snapshot['stages'], key=lambda s: -s['seconds']):
+            rows.append('{0:<16}{1:<32}{2:>7}{3:>11.3f}{4:>10.1f}{5:>10.1f}'.format(
+                s['stage'], labels(s, 'stage', 'count', 'seconds', 'max'), s['count'], s['seconds'],
+                s['seconds'] / s['count'] * 1000, s['max'] * 1000))
+        for c in snapshot['counters']:
+            rows.append('{0:<16}{1:<32}{2:>17}'.format(c['name'], labels(c, 'name', 'value'), c['value']))
+        for g in snapshot['gauges']:
+            rows.append('{0:<16}{1:<32}{2:>17}'.format(g['name'] + ' max', labels(g, 'name', 'last', 'max'), g['max']))
+        return '\n'.join(rows)
+
+    def report(self, reset: bool = True) -> None:
+        """
+        End of run: summary JSON line, Prometheus textfile and summary table.
+
+        :param reset: start a new run afterwards.
+        """
+        snapshot = self.snapshot()
+        self._emit(dict(snapshot, type='summary', elapsed=round(time.time() - self.started, 3)))
+        if self.prometheus_path:
+            try:
+                self._write_prometheus()
+            except OSError:
+                self.logger.exception('prometheus textfile write failed.')
+        self.logger.info('run metrics\n{0}'.format(self.summary()))
+        if reset:
+            with self._lock:
+                self._stages = {}
+                self._counters = {}
+                self._gauges = {}
+                self.started = time.time()
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics() -> Metrics:
+    """
+    Process-wide metrics. PDFC_METRICS_FILE / PDFC_METRICS_PROMETHEUS set the outputs.
+    """
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics(os.environ.get('PDFC_METRICS_FILE'), os.environ.get('PDFC_METRICS_PROMETHEUS'))
+        return _metrics
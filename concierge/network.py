@@ -0,0 +1,202 @@
+import hashlib
+import json
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+from urllib3.util.retry import Retry
+
+from .config import env_int, env_float, cache_dir
+from .metrics import get_metrics
+from .throttle import LISTING, PAGE, DOWNLOAD, request_scheduler
+
+
+class ValidatorCache:
+    def __init__(self, path: str):
+        """
+        Persistent ETag / Last-Modified / body hash store per URL.
+        New validators are staged by `changed` and only written by `commit`,
+        so a run that fails after fetching a listing fetches it again next time.
+
+        :param path: json file.
+        """
+        self.path = path
+        self._entries = {}
+        self._staged = {}
+        self._lock = threading.Lock()
+        try:
+            with open(path, 'r') as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def headers(self, url: str) -> dict:
+        entry = self._entries.get(url, {})
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def changed(self, url: str, response: requests.Response) -> bool:
+        """
+        Stage validators of the response.
+
+        :return: False on 304 or when the body hash is unchanged.
+        """
+        if response.status_code == 304:
+            return False
+        body_hash = hashlib.sha256(response.content).hexdigest()
+        with self._lock:
+            self._staged[url] = {'etag': response.headers.get('ETag'),
+                                 'last_modified': response.headers.get('Last-Modified'),
+                                 'body_hash': body_hash}
+        return self._entries.get(url, {}).get('body_hash') != body_hash
+
+    def commit(self, url: str) -> None:
+        with self._lock:
+            if url not in self._staged:
+                return
+            self._entries[url] = self._staged.pop(url)
+            tmp = '{0}.tmp'.format(self.path)
+            with open(tmp, 'w') as f:
+                json.dump(self._entries, f)
+            os.replace(tmp, self.path)
+
+
+class HttpClient:
+    def __init__(self, pool_size: int = 0, timeout: float = 0, retries: int = -1, backoff: float = -1):
+        """
+        Keep-alive HTTP client with per-host connection pools.
+        Every request waits for its slot in the process-wide `request_scheduler`.
+        Every argument falls back to its PDFC_HTTP_* environment variable.
+
+        :param pool_size: max kept-alive connections per host.
+        :param timeout: connect/read timeout in seconds.
+        :param retries: retry count for connection errors and 429/5xx responses.
+        :param backoff: exponential backoff factor between retries.
+        """
+        self.pool_size = pool_size or env_int('PDFC_HTTP_POOL_SIZE', 10)
+        self.pool_hosts = env_int('PDFC_HTTP_POOL_HOSTS', 10)
+        self.timeout = timeout or env_float('PDFC_HTTP_TIMEOUT', 30)
+        self.retries = retries if retries >= 0 else env_int('PDFC_HTTP_RETRIES', 3)
+        self.backoff = backoff if backoff >= 0 else env_float('PDFC_HTTP_BACKOFF', 0.5)
+        self.chunk_size = env_int('PDFC_DOWNLOAD_CHUNK_SIZE', 64 * 1024)
+        self.session = self._make_session()
+        self.metrics = get_metrics()
+        self.scheduler = request_scheduler()
+
+    def _make_session(self) -> requests.Session:
+        retry = Retry(total=self.retries, backoff_factor=self.backoff,
+                      status_forcelist=(429, 500, 502, 503, 504), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=self.pool_hosts, pool_maxsize=self.pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    @property
+    def cookies(self):
+        return self.session.cookies
+
+    def _send(self, method: str, url: str, host: str, **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', self.timeout)
+        try:
+            r = self.session.request(method, url, **kwargs)
+        except requests.RequestException:
+            self.metrics.count('http_errors', host=host)
+            raise
+        self.metrics.count('http_requests', host=host, status=r.status_code)
+        retries = getattr(getattr(r.raw, 'retries', None), 'history', None)
+        if retries:
+            self.metrics.count('http_retries', len(retries), host=host)
+        return r
+
+    def request(self, method: str, url: str, lane: int = PAGE, **kwargs) -> requests.Response:
+        """
+
+        :param lane: scheduler lane, LISTING, PAGE or DOWNLOAD.
+        :return: response. with stream=True the slot is released before the body is read, use `download`.
+        """
+        host = urlsplit(url).hostname
+        with self.scheduler.slot(host, lane):
+            r = self._send(method, url, host, **kwargs)
+            if not kwargs.get('stream'):
+                size = len(r.content)
+                self.metrics.count('bytes', size, direction='in', host=host)
+                self.scheduler.transfer(size, lane)
+        return r
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def get_if_changed(self, url: str, validators: ValidatorCache, **kwargs):
+        """
+        Conditional GET with the validators cached for `url`.
+
+        :return: response or None when the resource is unchanged.
+        """
+        headers = dict(kwargs.pop('headers', None) or {})
+        headers.update(validators.headers(url))
+        kwargs.setdefault('lane', LISTING)
+        r = self.get(url, headers=headers, **kwargs)
+        if r.status_code != 304:
+            r.raise_for_status()
+        return r if validators.changed(url, r) else None
+
+    def download(self, method: str, url: str, fp, lane: int = DOWNLOAD, **kwargs) -> requests.Response:
+        """
+        Stream the response body into `fp` chunk by chunk,
+        so memory use does not grow with the file size.
+        The scheduler slot is held until the body is read.
+
+        :param method:
+        :param url:
+        :param fp: writable binary file object.
+        :param lane: scheduler lane.
+        :return: closed response. headers are still available.
+        """
+        size = 0
+        host = urlsplit(url).hostname
+        with self.scheduler.slot(host, lane):
+            with self._send(method, url, host, stream=True, **kwargs) as r:
+                r.raise_for_status()
+                for chunk in r.iter_content(chunk_size=self.chunk_size):
+                    if chunk:
+                        fp.write(chunk)
+                        size += len(chunk)
+                        self.scheduler.transfer(len(chunk), lane)
+        self.metrics.count('bytes', size, direction='in', host=host)
+        return r
+
+
+_shared_client = None
+_shared_client_lock = threading.Lock()
+
+
+def shared_client() -> HttpClient:
+    """
+    Process-wide client for cookie-less scrapers.
+    """
+    global _shared_client
+    with _shared_client_lock:
+        if _shared_client is None:
+            _shared_client = HttpClient()
+        return _shared_client
+
+
+_validator_cache = None
+
+
+def validator_cache() -> ValidatorCache:
+    global _validator_cache
+    with _shared_client_lock:
+        if _validator_cache is None:
+            _validator_cache = ValidatorCache(os.path.join(cache_dir('http'), 'validators.json'))
+        return _validator_cache
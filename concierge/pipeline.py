@@ -0,0 +1,115 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .logger import get_logger
+from .metrics import get_metrics
+
+
+class SourceScheduler:
+    def __init__(self, max_workers: int = 0):
+        """
+        Run jobs of every enabled source at the same time.
+        Parallelism inside a source is up to the source, e.g. PDFC_MK_WORKERS.
+
+        :param max_workers: total worker threads. 0 means one worker per job.
+        """
+        self.logger = get_logger(__name__)
+        self.max_workers = max_workers
+        self._jobs = []
+
+    def _run_job(self, source: str, fn, args, kwargs):
+        self.logger.info('{0} job start.'.format(source))
+        result = fn(*args, **kwargs)
+        self.logger.info('{0} job done.'.format(source))
+        return result
+
+    def submit(self, source: str, fn, *args, **kwargs) -> None:
+        self._jobs.append((source, fn, args, kwargs))
+
+    def run(self) -> dict:
+        """
+        Run all submitted jobs and wait for them.
+        A failed job is logged and left out of the result.
+
+        :return: {source: [job result, ...]}
+        """
+        results = {}
+        if not self._jobs:
+            return results
+        jobs, self._jobs = self._jobs, []
+        workers = self.max_workers if self.max_workers > 0 else len(jobs)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [(source, executor.submit(self._run_job, source, fn, args, kwargs))
+                       for source, fn, args, kwargs in jobs]
+            for source, future in futures:
+                try:
+                    results.setdefault(source, []).append(future.result())
+                except Exception:
+                    self.logger.exception('{0} job failed.'.format(source))
+        return results
+
+
+class UploadQueue:
+    def __init__(self, handler, workers: int = 2, max_pending: int = 4, batch_size: int = 1):
+        """
+        Bounded producer/consumer queue for the upload stage.
+        Producers block on `put` while `max_pending` files are waiting,
+        which also caps how many temp files exist at once.
+
+        :param handler: callable([(filetype, file_result), ...]) run by upload workers.
+        :param workers: number of upload worker threads.
+        :param max_pending: queue size.
+        :param batch_size: max files a worker takes from the queue at once.
+        """
+        self.logger = get_logger(__name__)
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.queue = queue.Queue(maxsize=max(1, max_pending))
+        self.metrics = get_metrics()
+        self._threads = []
+
+    def start(self) -> None:
+        for i in range(self.workers):
+            t = threading.Thread(target=self._work, name='upload-{0}'.format(i), daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def _take_batch(self) -> list:
+        items = [self.queue.get()]
+        while len(items) < self.batch_size and items[-1] is not None:
+            try:
+                items.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _work(self) -> None:
+        while True:
+            items = self._take_batch()
+            batch = [i for i in items if i is not None]
+            try:
+                if batch:
+                    self.handler(batch)
+            except Exception:
+                self.logger.exception('upload failed.')
+            finally:
+                for _ in items:
+                    self.queue.task_done()
+            if items[-1] is None:
+                return
+
+    def put(self, filetype: str, file_result: dict) -> None:
+        self.queue.put((filetype, file_result))
+        self.metrics.gauge('queue_depth', self.queue.qsize(), queue='upload')
+
+    def close(self) -> None:
+        """
+        Wait until every queued file is uploaded and stop the workers.
+        """
+        for _ in self._threads:
+            self.queue.put(None)
+        for t in self._threads:
+            t.join()
+        self._threads = []
@@ -0,0 +1,100 @@
+import re
+from datetime import datetime, timedelta
+
+_units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+class Interval:
+    def __init__(self, seconds: float):
+        self.seconds = max(1.0, seconds)
+
+    def next_after(self, moment: datetime) -> datetime:
+        return moment + timedelta(seconds=self.seconds)
+
+    def __repr__(self):
+        return 'Interval({0}s)'.format(self.seconds)
+
+
+class Cron:
+    # (low, high) of minute, hour, day of month, month, day of week
+    _ranges = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+
+    def __init__(self, expression: str):
+        """
+        Five field cron expression: minute hour day-of-month month day-of-week.
+        Fields take *, numbers, ranges (a-b), steps (*/n, a-b/n) and lists (a,b).
+        Day of week 0 and 7 are Sunday. As in cron, when both day fields are restricted
+        a day matching either of them is used.
+
+        :param expression:
+        """
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError('cron expression needs 5 fields: {0}'.format(expression))
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = \
+            [self._parse(f, lo, hi if i != 4 else 7) for i, (f, (lo, hi)) in enumerate(zip(fields, self._ranges))]
+        self.weekdays = {d % 7 for d in weekdays}
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    @staticmethod
+    def _parse(field: str, lo: int, hi: int) -> set:
+        values = set()
+        for part in field.split(','):
+            m = re.fullmatch(r'(\*|\d+(?:-\d+)?)(?:/(\d+))?', part)
+            if not m:
+                raise ValueError('invalid cron field: {0}'.format(field))
+            span, step = m.group(1), int(m.group(2) or 1)
+            if span == '*':
+                start, end = lo, hi
+            elif '-' in span:
+                start, end = (int(v) for v in span.split('-'))
+            else:
+                start = end = int(span)
+                if m.group(2):
+                    end = hi
+            if start < lo or end > hi or start > end or step < 1:
+                raise ValueError('cron field out of range: {0}'.format(field))
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, moment: datetime) -> bool:
+        day = moment.day in self.days
+        weekday = (moment.isoweekday() % 7) in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next_after(self, moment: datetime) -> datetime:
+        t = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = t + timedelta(days=366 * 4)
+        while t < limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += timedelta(minutes=1)
+            else:
+                return t
+        raise ValueError('cron expression never matches: {0}'.format(self.expression))
+
+    def __repr__(self):
+        return 'Cron({0!r})'.format(self.expression)
+
+
+def parse_schedule(spec: str):
+    """
+    Interval such as "3600", "30m", "6h", "1d" or a five field cron expression.
+
+    :param spec:
+    :return: Interval or Cron
+    """
+    spec = spec.strip()
+    m = re.fullmatch(r'(\d+(?:\.\d+)?)\s*([smhd]?)', spec)
+    if m:
+        return Interval(float(m.group(1)) * _units[m.group(2) or 's'])
+    return Cron(spec)
@@ -1,5 +1,72 @@
-from .mk import MkScraper
-from .asahi import AsahiScraper
-from .yomiuri import YomiuriScraper
-from .new_yorker import NewYorkerScraper
-from .guardian import GuardianScraper
+import importlib
+
+# source name: (module, scraper class). modules are imported only when the source is enabled.
+scrapers = {
+    'mk': ('concierge.scraper.mk', 'MkScraper'),
+    'asahi': ('concierge.scraper.asahi', 'AsahiScraper'),
+    'yomiuri': ('concierge.scraper.yomiuri', 'YomiuriScraper'),
+    'new-yorker': ('concierge.scraper.new_yorker', 'NewYorkerScraper'),
+    'guardian': ('concierge.scraper.guardian', 'GuardianScraper')
+}
+
+# installed distributions add sources under this entry point group, e.g.
+# [options.entry_points] pdfconcierge.sources = nikkei = pdfc_nikkei:NikkeiScraper
+entry_point_group = 'pdfconcierge.sources'
+
+_plugins = None
+
+
+def _entry_points() -> list:
+    try:
+        from importlib import metadata
+    except ImportError:
+        # python 3.7
+        import pkg_resources
+        return [(ep.name, ep.module_name, '.'.join(ep.attrs))
+                for ep in pkg_resources.iter_entry_points(entry_point_group)]
+    eps = metadata.entry_points()
+    if hasattr(eps, 'select'):
+        eps = eps.select(group=entry_point_group)
+    else:
+        eps = eps.get(entry_point_group, [])
+    return [(ep.name,) + tuple(ep.value.split(':', 1)) for ep in eps if ':' in ep.value]
+
+
+def plugin_scrapers() -> dict:
+    """
+    Sources registered by installed distributions. built-in names can not be replaced.
+
+    :return: source name: (module, scraper class)
+    """
+    global _plugins
+    if _plugins is None:
+        _plugins = {name: (module.strip(), cls.strip()) for name, module, cls in _entry_points()
+                    if name not in scrapers}
+    return _plugins
+
+
+def available_scrapers() -> dict:
+    return dict(plugin_scrapers(), **scrapers)
+
+
+def load_scraper(source: str):
+    """
+
+    :param source: source name.
+    :return: scraper class
+    """
+    try:
+        module, name = scrapers[source]
+    except KeyError:
+        try:
+            module, name = plugin_scrapers()[source]
+        except KeyError:
+            raise ValueError('unknown source: {0}'.format(source))
+    return getattr(importlib.import_module(module), name)
+
+
+def __getattr__(name):
+    for module, cls in scrapers.values():
+        if cls == name:
+            return getattr(importlib.import_module(module), cls)
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
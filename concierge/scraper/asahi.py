@@ -1,15 +1,17 @@
 import bs4
 import os.path
-import pdfkit
-import pytz
-import requests
 import tempfile
 import urllib.parse
-from bs4 import BeautifulSoup
+from bs4 import SoupStrainer
 from datetime import datetime, timezone, timedelta
 
 from concierge.logger import get_logger
-from concierge.scraper.common import Figure, template_path, template_loader, title_normalizer, render_option_us_letter
+from concierge.metrics import get_metrics
+from concierge.scraper.common import Figure, template_path, get_template_loader, title_normalizer
+from concierge.scraper.parser import parse_html
+from concierge.scraper.images import image_cache
+from concierge.scraper.render import render_service
+from concierge.scraper.source import Source
 
 
 class AsahiEditorial:
@@ -27,12 +29,11 @@ class AsahiEditorial:
         self.body = body
         self.figure = figure
         self.template_path = template_path
-        self.template = template_loader.get_template('asahi-editorial.html')
+        self.template = get_template_loader().get_template('asahi-editorial.html')
         self.temp_output = tempfile.NamedTemporaryFile(mode='w+b', delete=False)
-        self.temp_image = tempfile.NamedTemporaryFile()
-        if self.figure.image:
-            self.temp_image.write(self.figure.image)
-        self.temp_html = self._render_html()
+        self._rendering = None
+        with get_metrics().timer('render_html', source='asahi'):
+            self.temp_html = self._render_html()
 
     def _render_html(self):
         return self.template.render(
@@ -43,7 +44,7 @@ class AsahiEditorial:
             article_id=self.id,
             date=self.date,
             article=self.body,
-            figure_img=self.temp_image.name,
+            figure_img=self.figure.path,
             figure_cap=self.figure.caption
         )
 
@@ -54,16 +55,29 @@ class AsahiEditorial:
 
         :return:
         """
-        self.temp_output.write(pdfkit.from_string(self.temp_html, output_path=False, options=render_option_us_letter))
-        self.temp_output.close()
+        if not self._rendering:
+            self.temp_output.close()
+            service = render_service()
+            cache_key = service.cache_key(self.temp_html, self.figure.read())
+            self._rendering = service.submit(self.temp_html, self.temp_output.name, cache_key)
+        return self._rendering
+
+    def render(self):
+        """
+        Queue the PDF render without waiting for it.
+
+        :return:
+        """
+        self._render_us_letter()
 
     def develop(self):
         self.logger.info('develop editorial...')
-        self._render_us_letter()
-        return {'path': self.temp_output.name, 'category': 'asahi', 'filename': self.filename, 'file_ext': '.pdf'}
+        render_service().result(self._render_us_letter())
+        return {'path': self.temp_output.name, 'category': 'asahi', 'id': self.id,
+                'filename': self.filename, 'file_ext': '.pdf'}
 
     def clear(self):
-        self.temp_image.close()
+        pass
 
 
 def _extract_article_id(url: str) -> str:
@@ -77,38 +91,45 @@ def _extract_article_id(url: str) -> str:
     return editorial_id
 
 
-class AsahiScraper:
-    def __init__(self, pdf_format: str):
-        self.logger = get_logger(__name__)
-        self.pdf_format = pdf_format
-        self.timezone = pytz.timezone('Asia/Tokyo')
-        self.today = datetime.now(tz=self.timezone)
-        self._result = {'editorial': []}
+class AsahiScraper(Source):
+    name = 'asahi'
+    timezone_name = 'Asia/Tokyo'
+
+    def __init__(self, pdf_format: str, on_result=None, history: dict = None):
+        super().__init__(pdf_format, on_result=on_result, history=history)
+        self.images = image_cache()
         self._asahi_news_url = 'https://www.asahi.com'
         self.asahi_editorial_view_url = self._asahi_news_url + '/articles/{0}.html?iref=pc_rensai_long_16_article'
         self.asahi_editorials_url = 'https://www.asahicom.jp/rensai/json/da16.json'
 
-    def _fetch_editorial_list(self) -> list:
+    def list_items(self) -> list:
         """
         Fetch editorial list by current date.
 
-        :return: List of editorial article path.
+        :return: List of editorial page id.
         """
         editorials = []
-        r = requests.get(self.asahi_editorials_url, headers={'referer': self._asahi_news_url})
+        r = self.http.get_if_changed(self.asahi_editorials_url, self.validators,
+                                     headers={'referer': self._asahi_news_url})
+        if r is None:
+            self.logger.info('editorial list unchanged.')
+            return editorials
         for article in r.json()['items']:
             if datetime.strptime(article['release_date'], '%Y%m%d%H%M%S').date() >= self.today.date():
                 editorials.append(article['id'])
         return editorials
 
-    def _fetch_editorial_page(self, url: str) -> bs4.element.Tag:
+    def item_id(self, page_id: str) -> str:
+        return _extract_article_id(self.asahi_editorial_view_url.format(page_id))
+
+    def fetch(self, page_id: str) -> bs4.element.Tag:
         """
 
-        :param url: Url for fetch.
+        :param page_id: editorial page id.
         :return:
         """
-        r = requests.get(url)
-        parse = BeautifulSoup(r.content, features='html.parser').find('main')
+        r = self.http.get(self.asahi_editorial_view_url.format(page_id))
+        parse = parse_html(r.content, parse_only=SoupStrainer('main')).find('main')
         return parse
 
     def _extract_editorial_title(self, contents: bs4.element.Tag) -> str:
@@ -126,19 +147,12 @@ class AsahiScraper:
         :param contents:
         :return:
         """
-        image = b''
         figure = contents.find('figure')
         caption = figure.find('figcaption').text
         image_url = figure.find('img').get('src')
         if image_url.startswith('//'):
             image_url = 'https:' + image_url
-        try:
-            r = requests.get(image_url)
-            if r.ok:
-                image = r.content
-        except ConnectionError:
-            pass
-        return Figure(image=image, caption=caption)
+        return Figure(path=self.images.fetch(image_url) or '', caption=caption)
 
     def _extract_editorial_body(self, contents: bs4.element.Tag) -> list:
         """
@@ -153,42 +167,19 @@ class AsahiScraper:
                 body.append(p.text)
         return body
 
-    def _fetch_editorial(self, page_id: str) -> AsahiEditorial:
+    def extract(self, page_id: str, contents: bs4.element.Tag) -> AsahiEditorial:
         """
 
-        :param url:
+        :param page_id:
+        :param contents:
         :return:
         """
-        self.logger.info('fetch editorial...')
         url = self.asahi_editorial_view_url.format(page_id)
-        article_id = _extract_article_id(url)
-        contents = self._fetch_editorial_page(url)
         title = self._extract_editorial_title(contents)
         figure = self._extract_editorial_figure(contents)
         body = self._extract_editorial_body(contents)
-        return AsahiEditorial(url=url, article_id=article_id, article_date=self.today.date(),
+        return AsahiEditorial(url=url, article_id=_extract_article_id(url), article_date=self.today.date(),
                               title=title, body=body, figure=figure)
 
-    def _push_to_result(self, payload) -> None:
-        """
-
-        :param payload:
-        :return:
-        """
-        self.logger.info('push to result article {0}'.format(payload.id))
-        result = payload.develop()
-        if result:
-            self._result[payload.type].append(result)
-        payload.clear()
-
-    def download_editorials(self) -> dict:
-        """
-
-        :return:
-        """
-        self.logger.info('download editorials from Asahi...')
-        articles = self._fetch_editorial_list()
-        if articles:
-            for a in articles:
-                self._push_to_result(self._fetch_editorial(a))
-        return self._result
+    def commit(self) -> None:
+        self.validators.commit(self.asahi_editorials_url)
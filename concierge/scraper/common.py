@@ -1,21 +1,32 @@
 import os
 from dataclasses import dataclass
 
-import jinja2
 import pathlib
 
 
 @dataclass
 class Figure:
-    image: bytes
+    path: str
     caption: str
 
+    def read(self) -> bytes:
+        if not self.path:
+            return b''
+        with open(self.path, 'rb') as f:
+            return f.read()
+
 
 def exclude_from_history(tasks, history) -> list:
+    result = []
+    seen = set()
     try:
-        return list(set(tasks) - set(history))
+        for t in tasks:
+            if t not in seen and t not in history:
+                seen.add(t)
+                result.append(t)
     except TypeError:
         return []
+    return result
 
 
 def title_normalizer(title) -> str:
@@ -23,7 +34,25 @@ def title_normalizer(title) -> str:
         .replace('\\', '').replace('|', '').replace(':', '-').replace("\"", "")
 
 template_path = os.path.join(pathlib.Path(__file__).parent.parent.resolve(), 'templates')
-template_loader = jinja2.Environment(loader=jinja2.FileSystemLoader(searchpath=template_path))
+_template_loader = None
+
+
+def get_template_loader():
+    """
+    Jinja environment for the editorial templates, built on first use.
+    """
+    global _template_loader
+    if _template_loader is None:
+        import jinja2
+        _template_loader = jinja2.Environment(loader=jinja2.FileSystemLoader(searchpath=template_path))
+    return _template_loader
+
+
+def __getattr__(name):
+    if name == 'template_loader':
+        return get_template_loader()
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
+
 render_option_us_letter = {
             'page-size': 'Letter',
             'margin-top': '0.4in',
@@ -0,0 +1,67 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from concierge.logger import get_logger
+
+
+class PageCrawler:
+    def __init__(self, fetch_page, last_page, page_url, extract, concurrency: int = 8):
+        """
+        Crawl paginated list pages of many categories concurrently.
+        First page of every category is fetched to learn the last page,
+        then all remaining pages are fetched at once. the request rate is up to the HttpClient scheduler.
+
+        :param fetch_page: blocking callable(url) -> parsed page.
+        :param last_page: callable(parsed first page) -> last page number.
+        :param page_url: callable(url, page number) -> url of that page.
+        :param extract: callable(parsed page) -> list of item ids.
+        :param concurrency: max requests in flight.
+        """
+        self.logger = get_logger(__name__)
+        self.fetch_page = fetch_page
+        self.last_page = last_page
+        self.page_url = page_url
+        self.extract = extract
+        self.concurrency = max(1, concurrency)
+        self._executor = None
+        self._semaphore = None
+
+    async def _fetch(self, url: str):
+        async with self._semaphore:
+            return await asyncio.get_event_loop().run_in_executor(self._executor, self.fetch_page, url)
+
+    async def _extract(self, url: str) -> list:
+        contents = await self._fetch(url)
+        return self.extract(contents)
+
+    async def _crawl_category(self, name: str, url: str) -> list:
+        contents = await self._fetch(url)
+        last_page = self.last_page(contents)
+        items = self.extract(contents)
+        if last_page > 1:
+            pages = await asyncio.gather(*[self._extract(self.page_url(url, i)) for i in range(2, last_page + 1)])
+            for p in pages:
+                items += p
+        self.logger.info('{0} - {1}'.format(name, len(items)))
+        return items
+
+    async def _crawl(self, urls: dict) -> dict:
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        names = list(urls.keys())
+        results = await asyncio.gather(*[self._crawl_category(n, urls[n]) for n in names])
+        return dict(zip(names, results))
+
+    def crawl(self, urls: dict) -> dict:
+        """
+
+        :param urls: {category: first page url}
+        :return: {category: [item id, ...]}
+        """
+        if not urls:
+            return {}
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        try:
+            return asyncio.run(self._crawl(urls))
+        finally:
+            self._executor.shutdown(wait=True)
+            self._executor = None
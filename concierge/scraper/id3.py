@@ -0,0 +1,150 @@
+import os
+import shutil
+import struct
+
+_header_size = 10
+_default_padding = 2048
+
+_picture_types = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG', 'image/png'),
+    (b'GIF8', 'image/gif'),
+)
+
+
+def _synchsafe(size: int) -> bytes:
+    return bytes(((size >> 21) & 0x7f, (size >> 14) & 0x7f, (size >> 7) & 0x7f, size & 0x7f))
+
+
+def _unsynchsafe(data: bytes) -> int:
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+def _frame(frame_id: str, body: bytes) -> bytes:
+    return frame_id.encode('ascii') + struct.pack('>IH', len(body), 0) + body
+
+
+def _text(value: str) -> bytes:
+    # UTF-16 with BOM, the only unicode encoding ID3v2.3 has
+    return b'\xff\xfe' + value.encode('utf-16-le')
+
+
+def text_frame(frame_id: str, value: str) -> bytes:
+    return _frame(frame_id, b'\x01' + _text(value))
+
+
+def comment_frame(value: str, lang: str = 'eng') -> bytes:
+    return _frame('COMM', b'\x01' + lang.encode('ascii') + _text('') + b'\x00\x00' + _text(value))
+
+
+def picture_frame(data: bytes, mime: str = None) -> bytes:
+    """
+    Front cover picture.
+
+    :param data: image bytes.
+    :param mime: detected from the data when omitted.
+    """
+    if not mime:
+        mime = next((m for magic, m in _picture_types if data.startswith(magic)), 'image/jpeg')
+    return _frame('APIC', b'\x00' + mime.encode('ascii') + b'\x00' + b'\x03' + b'\x00' + data)
+
+
+def id3_frames(title: str, artist: str = None, album: str = None, genre: str = None,
+               comment: str = None, cover: bytes = None) -> bytes:
+    """
+
+    :return: ID3v2.3 frames, without the tag header.
+    """
+    frames = [text_frame('TIT2', title)]
+    for frame_id, value in (('TPE1', artist), ('TALB', album), ('TCON', genre)):
+        if value:
+            frames.append(text_frame(frame_id, value))
+    if comment:
+        frames.append(comment_frame(comment))
+    if cover:
+        frames.append(picture_frame(cover))
+    return b''.join(frames)
+
+
+def id3_tag(frames: bytes, padding: int = _default_padding) -> bytes:
+    """
+    Tag header, frames and zero padding. The padding lets a later tag be written in place.
+
+    :param frames: output of `id3_frames`.
+    :param padding:
+    """
+    size = len(frames) + padding
+    return b'ID3\x03\x00\x00' + _synchsafe(size) + frames + b'\x00' * padding
+
+
+def tag_size(head: bytes) -> int:
+    """
+
+    :param head: first 10 bytes of a file or stream.
+    :return: size of the ID3v2 tag at the start, 0 when there is none.
+    """
+    if len(head) < _header_size or not head.startswith(b'ID3') or any(b & 0x80 for b in head[6:10]):
+        return 0
+    footer = _header_size if head[5] & 0x10 else 0
+    return _header_size + _unsynchsafe(head[6:10]) + footer
+
+
+class StripTag:
+    def __init__(self, fp):
+        """
+        Writable wrapper that drops an ID3v2 tag at the start of the written stream,
+        so a downloaded file can be prefixed with our own tag in one pass.
+
+        :param fp: writable binary file object.
+        """
+        self.fp = fp
+        self._head = b''
+        self._skip = None
+        # size of the dropped tag, known once the first 10 bytes are written.
+        self.tag_size = None
+
+    def write(self, data: bytes) -> int:
+        written = len(data)
+        if self._skip is None:
+            self._head += data
+            if len(self._head) < _header_size:
+                return written
+            self._skip = self.tag_size = tag_size(self._head[:_header_size])
+            data, self._head = self._head, b''
+        if self._skip:
+            dropped = min(self._skip, len(data))
+            self._skip -= dropped
+            data = data[dropped:]
+        if data:
+            self.fp.write(data)
+        return written
+
+    def close(self) -> None:
+        """
+        Write out a stream shorter than a tag header.
+        """
+        if self._skip is None and self._head:
+            self.fp.write(self._head)
+            self._head = b''
+
+
+def write_tag(path: str, frames: bytes) -> None:
+    """
+    Replace the ID3v2 tag of a file. When the frames fit in the existing tag and its padding
+    only the tag region is rewritten, otherwise the file is copied once behind a new tag.
+
+    :param path:
+    :param frames: output of `id3_frames`.
+    """
+    with open(path, 'r+b') as f:
+        existing = tag_size(f.read(_header_size))
+        if existing >= _header_size + len(frames):
+            f.seek(0)
+            f.write(id3_tag(frames, existing - _header_size - len(frames)))
+            return
+        f.seek(existing)
+        tmp = path + '.id3'
+        with open(tmp, 'wb') as out:
+            out.write(id3_tag(frames))
+            shutil.copyfileobj(f, out, 1024 * 1024)
+    os.replace(tmp, path)
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from concierge.config import env_int, cache_dir
+from concierge.logger import get_logger
+from concierge.network import HttpClient, shared_client
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+class ImageCache:
+    def __init__(self, path: str, http: HttpClient, max_size: int, ttl: int = 86400, max_width: int = 0,
+                 quality: int = 85):
+        """
+        On-disk image cache keyed by URL.
+        Cached files are revalidated with ETag / Last-Modified once they are older than `ttl`,
+        and evicted least recently used first above `max_size`.
+        Renderers reference the cached file directly.
+
+        :param path: cache directory.
+        :param http:
+        :param max_size: max total bytes.
+        :param ttl: seconds a cached image is used without revalidation.
+        :param max_width: downscale wider images to this width. 0 keeps the original. needs Pillow.
+        :param quality: JPEG quality of downscaled images.
+        """
+        self.logger = get_logger(__name__)
+        self.path = path
+        self.http = http
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_width = max_width
+        self.quality = quality
+        self._lock = threading.Lock()
+
+    def _paths(self, url: str):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.path, key), os.path.join(self.path, '{0}.json'.format(key))
+
+    def _read_meta(self, meta_path: str) -> dict:
+        try:
+            with open(meta_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def fetch(self, url: str, optimize: bool = True, **kwargs):
+        """
+
+        :param url: image url.
+        :param optimize: allow downscale / recompress.
+        :return: cached file path or None when the image is not available.
+        """
+        path, meta_path = self._paths(url)
+        meta = self._read_meta(meta_path)
+        cached = os.path.isfile(path)
+        if cached and time.time() - meta.get('checked', 0) < self.ttl:
+            os.utime(path)
+            return path
+        headers = dict(kwargs.pop('headers', None) or {})
+        if cached and meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if cached and meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        try:
+            r = self.http.get(url, headers=headers, **kwargs)
+        except Exception:
+            self.logger.info('image fetch failed {0}'.format(url))
+            return path if cached else None
+        if r.status_code == 304 and cached:
+            meta['checked'] = time.time()
+        elif r.ok:
+            tmp = '{0}.{1}.tmp'.format(path, threading.get_ident())
+            with open(tmp, 'wb') as f:
+                f.write(r.content)
+            if optimize:
+                self._optimize(tmp)
+            os.replace(tmp, path)
+            meta = {'etag': r.headers.get('ETag'), 'last_modified': r.headers.get('Last-Modified'),
+                    'checked': time.time()}
+        else:
+            return path if cached else None
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f)
+        self._evict()
+        return path
+
+    def _optimize(self, path: str) -> None:
+        if not self.max_width or Image is None:
+            return
+        try:
+            with Image.open(path) as img:
+                if img.width <= self.max_width:
+                    return
+                img.thumbnail((self.max_width, self.max_width * img.height // img.width))
+                img.convert('RGB').save(path, format='JPEG', quality=self.quality, optimize=True)
+        except (OSError, ValueError):
+            self.logger.info('image optimize failed {0}'.format(path))
+
+    def _evict(self) -> None:
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.path):
+                if name.endswith('.json') or name.endswith('.tmp'):
+                    continue
+                try:
+                    st = os.stat(os.path.join(self.path, name))
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, name))
+            total = sum(e[1] for e in entries)
+            for mtime, size, name in sorted(entries):
+                if total <= self.max_size:
+                    break
+                for p in (os.path.join(self.path, name), os.path.join(self.path, '{0}.json'.format(name))):
+                    try:
+                        os.remove(p)
+                    except OSError:
+                        pass
+                total -= size
+
+
+_image_cache = None
+_image_cache_lock = threading.Lock()
+
+
+def image_cache() -> ImageCache:
+    global _image_cache
+    with _image_cache_lock:
+        if _image_cache is None:
+            _image_cache = ImageCache(cache_dir('images'), shared_client(),
+                                      max_size=env_int('PDFC_IMAGE_CACHE_SIZE', 128 * 1024 * 1024),
+                                      ttl=env_int('PDFC_IMAGE_CACHE_TTL', 86400),
+                                      max_width=env_int('PDFC_IMAGE_MAX_WIDTH', 0),
+                                      quality=env_int('PDFC_IMAGE_QUALITY', 85))
+        return _image_cache
@@ -1,28 +1,42 @@
+import json
 import os
+import random
+import time
 import bs4.element
-import eyed3.id3
 import requests
 import re
-import eyed3
-import tempfile
-from bs4 import BeautifulSoup
+import threading
+from bs4 import SoupStrainer
 from tqdm import tqdm
 from urllib.parse import urlparse, parse_qs
-from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor, wait
 
+from concierge.checkpoint import Checkpoint
+from concierge.config import env_int, env_float
 from concierge.logger import get_logger
+from concierge.metrics import get_metrics
+from concierge.network import HttpClient
+from concierge.throttle import LISTING
 from concierge.scraper.common import exclude_from_history, title_normalizer
+from concierge.scraper.crawler import PageCrawler
+from concierge.scraper.id3 import StripTag, id3_frames, id3_tag, write_tag
+from concierge.scraper.images import image_cache
+from concierge.scraper.parser import parse_html
+from concierge.storage.secret import SecretStore
+
+book_info_style = re.compile(r'width:420px;height:40px;float:left;')
+category_menu_style = re.compile(r"background: url\(/images/sub/digest_leftmntitle_02.gif\) repeat-y")
 
 
 class MKDocument:
-    def __init__(self, book_id, filename, category, doc, convert_format):
+    def __init__(self, book_id, filename, category, temp_path, convert_format):
         """
         this class will refactored.
 
         :param book_id:
         :param filename:
         :param category:
-        :param doc:
+        :param temp_path: downloaded document path.
         :param convert_format:
         """
         self.type = 'book'
@@ -33,9 +47,7 @@ class MKDocument:
             os.path.basename(filename.encode('iso-8859-1').decode('cp949', 'replace')))  # R.I.P Hannakageul
         self.filename = title_normalizer(self.filename)
         self.title = self.filename
-        with tempfile.NamedTemporaryFile(mode='w+b', delete=False) as tmp:
-            tmp.write(doc)
-            self.temp_path = tmp.name
+        self.temp_path = temp_path
 
     def to_kindle_pdf(self):
         pass
@@ -47,7 +59,7 @@ class MKDocument:
         return self._result(self.temp_path)
 
     def _result(self, filepath):
-        return {'path': filepath, 'category': self.category,
+        return {'path': filepath, 'category': self.category, 'id': self.id,
                 'filename': self.filename, 'file_ext': self.file_extension}
 
     def convert(self) -> list:
@@ -65,14 +77,15 @@ class MKDocument:
 
 
 class MKAudiobook:
-    def __init__(self, audiobook_id, metadata, category, audio):
+    def __init__(self, audiobook_id, metadata, category, temp_path, tagged=False):
         """
         this class will refactored.
 
         :param audiobook_id:
         :param metadata:
         :param category:
-        :param audio:
+        :param temp_path: downloaded audio path.
+        :param tagged: the file already starts with our ID3 tag.
         """
         self.type = 'audiobook'
         self.id = audiobook_id
@@ -84,33 +97,153 @@ class MKAudiobook:
             self.thumb = metadata['thumb']
         else:
             self.thumb = None
-        with tempfile.NamedTemporaryFile(mode='w+b', delete=False) as tmp:
-            tmp.write(audio)
-            self.temp_path = tmp.name
+        self.temp_path = temp_path
+        self.tagged = tagged
+
+    def id3_frames(self) -> bytes:
+        return id3_frames(title=self.title, artist='BOOKCOSMOS', album='BOOKCOSMOS', genre='Audiobook',
+                          comment='{0} - {1}\nMK_Bookdigest ID: {2}'.format(self.author, self.publisher, self.id),
+                          cover=self.thumb)
+
+    def id3_tag(self) -> bytes:
+        """
+        Tag to write in front of the audio while it downloads.
+        """
+        with get_metrics().timer('id3', source='mk'):
+            return id3_tag(self.id3_frames())
 
     def _set_id3(self):
-        id3_tag = eyed3.load(self.temp_path)
-        id3_tag.initTag(eyed3.id3.tag.ID3_V2)
-        id3_tag.tag.title = self.title
-        id3_tag.tag.artist = 'BOOKCOSMOS'
-        id3_tag.tag.album = 'BOOKCOSMOS'
-        id3_tag.tag.genre = 'Audiobook'
-        id3_tag.tag.comments.set(
-            '{0} - {1}\nMK_Bookdigest ID: {2}'.format(self.author, self.publisher, self.id))
-        if self.thumb:
-            id3_tag.tag.images.set(eyed3.id3.frames.ImageFrame.FRONT_COVER, self.thumb, 'image/gif')
-        id3_tag.tag.save()
+        """
+        Tag a file downloaded without the tag. only the tag region is rewritten when it fits.
+        """
+        with get_metrics().timer('id3', source='mk'):
+            write_tag(self.temp_path, self.id3_frames())
+        self.tagged = True
 
     def _result(self, filepath):
-        return {'path': filepath, 'category': self.category, 'filename': self.title, 'file_ext': '.mp3'}
+        return {'path': filepath, 'category': self.category, 'id': self.id,
+                'filename': self.title, 'file_ext': '.mp3'}
 
     def convert(self) -> dict:
-        self._set_id3()
+        if not self.tagged:
+            self._set_id3()
         return self._result(self.temp_path)
 
 
+class _PartFile:
+    def __init__(self, path: str, url: str, prefix: bytes = b'', strip_tag: bool = False):
+        """
+        Work file being downloaded, resumable with a Range request.
+        The remote offset and validators are kept in a json file next to it.
+
+        :param path: .part path.
+        :param url:
+        :param prefix: bytes written before the body, e.g. our ID3 tag. kept when resumed.
+        :param strip_tag: drop an ID3 tag at the start of the body.
+        """
+        self.path = path
+        self.meta_path = path + '.json'
+        self.url = url
+        self.prefix = prefix
+        self.strip_tag = strip_tag
+        self.meta = {}
+        self.offset = 0
+        self._file = None
+        self._body = None
+        self._strip = None
+
+    def _read_meta(self) -> dict:
+        try:
+            with open(self.meta_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def open(self, resume: bool = True) -> None:
+        meta = self._read_meta() if resume else {}
+        size = os.path.getsize(self.path) if os.path.isfile(self.path) else 0
+        if meta.get('url') == self.url and meta.get('skipped') is not None and size > meta['prefix']:
+            self.meta = meta
+            self.offset = size - meta['prefix'] + meta['skipped']
+            self._file = open(self.path, 'ab')
+        else:
+            self.meta = {'url': self.url, 'prefix': len(self.prefix), 'skipped': None}
+            self.offset = 0
+            self._file = open(self.path, 'wb')
+        self._body = None
+        self._strip = None
+
+    def headers(self) -> dict:
+        if not self.offset:
+            return {}
+        headers = {'Range': 'bytes={0}-'.format(self.offset)}
+        validator = self.meta.get('etag') or self.meta.get('last_modified')
+        if validator:
+            headers['If-Range'] = validator
+        return headers
+
+    def begin(self, response, *args, **kwargs):
+        """
+        requests response hook. appends a partial response, restarts the file on a full one.
+        """
+        if response.is_redirect or not response.ok:
+            return
+        if self.offset and response.status_code == 206:
+            m = re.match(r'bytes (\d+)-', response.headers.get('Content-Range', ''))
+            if not m or int(m.group(1)) != self.offset:
+                self.meta['url'] = None
+                raise requests.RequestException('unexpected Content-Range: {0}'.format(
+                    response.headers.get('Content-Range')))
+            self._body = self._file
+            return
+        self._file.seek(0)
+        self._file.truncate()
+        self._file.write(self.prefix)
+        self.offset = 0
+        self.meta = {'url': self.url, 'prefix': len(self.prefix), 'skipped': None if self.strip_tag else 0,
+                     'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified')}
+        self._strip = StripTag(self._file) if self.strip_tag else None
+        self._body = self._strip or self._file
+
+    def write(self, data: bytes) -> int:
+        written = self._body.write(data)
+        if self._strip and self.meta['skipped'] is None:
+            self.meta['skipped'] = self._strip.tag_size
+        return written
+
+    def close(self, complete: bool = False) -> None:
+        if complete and self._strip:
+            self._strip.close()
+        self._file.close()
+        if not complete:
+            with open(self.meta_path, 'w') as f:
+                json.dump(self.meta, f)
+
+    def finish(self, path: str) -> None:
+        os.replace(self.path, path)
+        self.discard(self.meta_path)
+
+    def discard(self, *paths) -> None:
+        for path in paths or (self.path, self.meta_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def _retryable(error: Exception) -> bool:
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return status >= 500 or status in (408, 416, 429)
+    return isinstance(error, requests.RequestException)
+
+
 class MkScraper:
-    def __init__(self, mk_id: str, mk_pw: str, pdf_format: str, history: dict):
+    name = 'mk'
+    history_kinds = ('book', 'audiobook')
+
+    def __init__(self, mk_id: str, mk_pw: str, pdf_format: str, history: dict, on_result=None,
+                 checkpoint: Checkpoint = None, session_store: SecretStore = None):
         """
         This class will refactored.
 
@@ -118,12 +251,17 @@ class MkScraper:
         :param mk_pw:
         :param pdf_format:
         :param history:
+        :param on_result: callable(filetype, file_result) called as soon as each file is converted.
+        :param checkpoint: progress journal to resume an interrupted run.
+        :param session_store: encrypted store of the login cookies, reused while they are valid.
         """
         self.logger = get_logger(__name__)
         self.id = mk_id
         self.pw = mk_pw
         self.pdf_format = pdf_format
         self.history = history
+        self.on_result = on_result
+        self.checkpoint = checkpoint if checkpoint else Checkpoint()
         self.result = {'book': [], 'audiobook': []}
         self._mk_digest_url = 'http://digest.mk.co.kr'
         self.mk_digest_index = self._mk_digest_url + '/Main/Index.asp'
@@ -139,36 +277,133 @@ class MkScraper:
         self.mk_digest_login_url = self._mk_digest_url + '/loginAction.asp'
         self.mk_login_phase_one_url = 'https://member.mk.co.kr/member_login_process.php'
         self.mk_login_phase_two_url = 'https://member.mk.co.kr/mem/v1/action.php'
-        self.cookies = requests.Session()
-        self._login()
+        self.workers = env_int('PDFC_MK_WORKERS', 3)
+        self.download_retries = env_int('PDFC_MK_DOWNLOAD_RETRIES', 4)
+        self.download_backoff = env_float('PDFC_MK_DOWNLOAD_BACKOFF', 1)
+        self.download_backoff_max = env_float('PDFC_MK_DOWNLOAD_BACKOFF_MAX', 60)
+        self.retry_rounds = env_int('PDFC_MK_RETRY_ROUNDS', 1)
+        self.errors = {}
+        self._retry_queue = []
+        self._resumed = set()
+        self._lock = threading.Lock()
+        self.crawl_concurrency = env_int('PDFC_MK_CRAWL_CONCURRENCY', 8)
+        self.http = HttpClient()
+        self.images = image_cache()
+        self.metrics = get_metrics()
+        self.session_store = session_store
+        self.session_ttl = env_int('PDFC_MK_SESSION_TTL', 12 * 3600)
+        self.session_check_interval = env_int('PDFC_MK_SESSION_CHECK', 300)
+        # optional text the logged-in index must contain, on top of the login page check.
+        self.session_marker = os.environ.get('PDFC_MK_SESSION_MARKER')
+        self._session_checked = 0
+        self._ensure_login()
+
+    def reset(self, history: dict = None) -> None:
+        """
+        Prepare for another run in the same process. The login session is kept.
+
+        :param history: staged history for the run. kept when omitted.
+        :return:
+        """
+        self.result = {'book': [], 'audiobook': []}
+        self.errors = {}
+        self._retry_queue = []
+        if history is not None:
+            self.history = history
+        if time.time() - self._session_checked > self.session_check_interval and not self._session_valid():
+            self.logger.info('mk session expired.')
+            self._login()
+            self._save_session()
 
     def _login(self):
-        self.__login_phase_one()
-        self.__login_phase_two()
-        self.__login_phase_three()
+        with self.metrics.timer('login', source='mk'):
+            self.__login_phase_one()
+            self.__login_phase_two()
+            self.__login_phase_three()
+
+    def _ensure_login(self):
+        if self._restore_session():
+            self.logger.info('reuse saved mk session.')
+            return
+        self._login()
+        self._save_session()
+
+    def _is_login_page(self, r: requests.Response) -> bool:
+        """
+        A logged-out request is redirected to the member login or gets the login form.
+        """
+        url = urlparse(r.url)
+        if url.netloc == urlparse(self.mk_login_phase_one_url).netloc or 'login' in url.path.lower():
+            return True
+        return parse_html(r.content, parse_only=SoupStrainer('input', attrs={'type': 'password'})).find('input') \
+            is not None
+
+    def _session_valid(self) -> bool:
+        """
+        One request to the digest index. The session is valid when it does not end on the login page.
+
+        :return:
+        """
+        try:
+            r = self.http.get(self.mk_digest_index)
+        except requests.RequestException:
+            return False
+        self._session_checked = time.time()
+        if not r.ok or self._is_login_page(r):
+            return False
+        return not self.session_marker or self.session_marker.lower().encode('utf-8') in r.content.lower()
+
+    def _restore_session(self) -> bool:
+        if not self.session_store:
+            return False
+        payload = self.session_store.load()
+        if not payload:
+            return False
+        try:
+            saved = json.loads(payload.decode('utf-8'))
+        except ValueError:
+            return False
+        if saved.get('id') != self.id or time.time() - saved.get('saved', 0) > self.session_ttl:
+            return False
+        for c in saved.get('cookies', []):
+            self.http.cookies.set(c['name'], c['value'], domain=c['domain'], path=c['path'],
+                                  expires=c['expires'], secure=c['secure'])
+        if self._session_valid():
+            return True
+        self.http.cookies.clear()
+        return False
+
+    def _save_session(self):
+        """
+        Save the login cookies, only once the login is verified so a failed login is not reused.
+        """
+        if not self.session_store:
+            return
+        if not self._session_valid():
+            self.logger.warning('mk login could not be verified, the digest index still asks for a login. '
+                                'session not saved.')
+            return
+        cookies = [{'name': c.name, 'value': c.value, 'domain': c.domain, 'path': c.path,
+                    'expires': c.expires, 'secure': c.secure} for c in self.http.cookies]
+        self.session_store.save(json.dumps({'id': self.id, 'saved': time.time(), 'cookies': cookies}).encode('utf-8'))
 
     def __login_phase_one(self):
-        r = requests.post(self.mk_login_phase_one_url,
-                          data={'user_id': self.id, 'password': self.pw,
-                                'successUrl': self.mk_digest_login_url})
+        self.http.post(self.mk_login_phase_one_url,
+                       data={'user_id': self.id, 'password': self.pw,
+                             'successUrl': self.mk_digest_login_url})
 
     def __login_phase_two(self):
-        r = requests.post(self.mk_login_phase_two_url,
-                          data={'id': self.id, 'pw': self.pw, 'c': 'login_action',
-                                'successUrl': self.mk_digest_login_url})
-        self.cookies = r.cookies
+        self.http.post(self.mk_login_phase_two_url,
+                       data={'id': self.id, 'pw': self.pw, 'c': 'login_action',
+                             'successUrl': self.mk_digest_login_url})
 
     def __login_phase_three(self):
-        r = requests.get(self.mk_digest_index, cookies=self.cookies)
-        r.cookies.update(self.cookies)
-        self.cookies = r.cookies
-        r = requests.get(self.mk_digest_login_url, cookies=self.cookies)
-        r.cookies.update(self.cookies)
-        self.cookies = r.cookies
+        self.http.get(self.mk_digest_index)
+        self.http.get(self.mk_digest_login_url)
 
     def _parse_book_metadata(self, content: bytes) -> dict:
-        raw_book_info = BeautifulSoup(content, features='html.parser') \
-            .find('div', style=re.compile(r'width:420px;height:40px;float:left;'))
+        raw_book_info = parse_html(content, parse_only=SoupStrainer('div', attrs={'style': book_info_style})) \
+            .find('div', style=book_info_style)
         raw_meta = " ".join(raw_book_info.find_all('div')[1].text.split()).split('/')
         title = raw_book_info.find('span').text
         title = title_normalizer(title)
@@ -180,42 +415,42 @@ class MkScraper:
         }
         return book_metadata
 
-    def _digest_book_scrap(self, url) -> list:
-        contents = self._fetch_book_page(url)
+    def _last_page(self, contents: bs4.element.Tag) -> int:
         try:
-            last_page = int(
+            return int(
                 parse_qs(
                     urlparse(contents.find_all('a')[-1].get('href')).query
                 )['page'][0])
         except KeyError:
-            last_page = 1
-        books = self._extract_book_data(contents)
-        if last_page > 1:
-            for i in range(1, last_page):
-                _u = requests.PreparedRequest()
-                _u.prepare_url(url, {'Type': 'T', 'page': i + 1})
-                contents = self._fetch_book_page(_u.url)
-                books += self._extract_book_data(contents)
-        return books
+            return 1
+
+    def _page_url(self, url: str, page: int) -> str:
+        _u = requests.PreparedRequest()
+        _u.prepare_url(url, {'Type': 'T', 'page': page})
+        return _u.url
+
+    def _crawl_categories(self, urls: dict) -> dict:
+        crawler = PageCrawler(fetch_page=self._fetch_book_page, last_page=self._last_page,
+                              page_url=self._page_url, extract=self._extract_book_data,
+                              concurrency=self.crawl_concurrency)
+        return crawler.crawl(urls)
+
+    def _digest_book_scrap(self, url) -> list:
+        return self._crawl_categories({url: url})[url]
 
     def _digest_all_book_scrap(self) -> dict:
         self.logger.info('scrap all books...')
-        books = {}
         categories = self._fetch_book_categories()
-        for name, code in categories.items():
-            self.logger.info('scrap from {0}...'.format(name))
-            books.update({
-                name: self._digest_book_scrap('{0}?code={1}'.format(self.mk_digest_books, code))
-            })
-            self.logger.info('{0} - {1}'.format(name, len(books[name])))
-        return books
+        return self._crawl_categories({
+            name: '{0}?code={1}'.format(self.mk_digest_books, code) for name, code in categories.items()
+        })
 
     def _fetch_book_categories(self) -> dict:
         self.logger.info('fetch categories...')
         categories = {}
-        r = requests.get(self.mk_digest_books_index, cookies=self.cookies)
-        raw_categories = BeautifulSoup(r.content, features='html.parser') \
-            .find('div', style=re.compile(r"background: url\(/images/sub/digest_leftmntitle_02.gif\) repeat-y")) \
+        r = self.http.get(self.mk_digest_books_index, lane=LISTING)
+        raw_categories = parse_html(r.content, parse_only=SoupStrainer('div', attrs={'style': category_menu_style})) \
+            .find('div', style=category_menu_style) \
             .find_all('a')
         for c in tqdm(raw_categories):
             try:
@@ -226,8 +461,9 @@ class MkScraper:
         return categories
 
     def _fetch_book_page(self, url):
-        r = requests.get(url, cookies=self.cookies)
-        parse = BeautifulSoup(r.content, features='html.parser').find('div', class_='bodybox')
+        r = self.http.get(url, lane=LISTING)
+        parse = parse_html(r.content, parse_only=SoupStrainer('div', attrs={'class': 'bodybox'})) \
+            .find('div', class_='bodybox')
         return parse
 
     def _extract_book_data(self, contents: bs4.element.Tag):
@@ -237,19 +473,71 @@ class MkScraper:
             books.append(parse_qs(urlparse(raw.parent.get('href')).query)['book_sno'][0])
         return books
 
+    def _completed_download(self, kind: str, item_id: str):
+        record = self.checkpoint.get('mk', kind, item_id)
+        if record and record['stage'] == 'downloaded' and os.path.isfile(record['path']) \
+                and os.path.getsize(record['path']) == record['size']:
+            self.logger.info('reuse downloaded {0} - {1}'.format(kind, item_id))
+            return record
+        return None
+
+    def _download_to_work_file(self, kind: str, item_id: str, method: str, url: str, id3: bytes = None,
+                               **kwargs):
+        """
+
+        Interrupted GET downloads resume from the bytes already written,
+        failed attempts are retried with exponential backoff and jitter.
+
+        :param id3: ID3 tag written before the body. a tag at the start of the body is dropped.
+        :return: path, response
+        """
+        path = self.checkpoint.work_path('mk-{0}-{1}'.format(kind, item_id))
+        part = _PartFile(path + '.part', url, prefix=id3 or b'', strip_tag=bool(id3))
+        headers = kwargs.pop('headers', None) or {}
+        attempt = 0
+        while True:
+            part.open(resume=method == 'GET')
+            if part.offset:
+                self.logger.info('resume {0} - {1} from {2} bytes'.format(kind, item_id, part.offset))
+                self.metrics.count('download_resumes', source='mk', kind=kind)
+            try:
+                r = self.http.download(method, url, part, headers=dict(headers, **part.headers()),
+                                       hooks={'response': part.begin}, **kwargs)
+            except Exception as e:
+                part.close()
+                if not _retryable(e) or isinstance(e, requests.HTTPError) and e.response.status_code == 416:
+                    part.discard()
+                attempt += 1
+                if attempt > self.download_retries or not _retryable(e):
+                    raise
+                delay = random.uniform(0, min(self.download_backoff_max, self.download_backoff * 2 ** attempt))
+                self.logger.info('{0} - {1} download failed ({2}). retry {3}/{4} in {5:.1f}s'.format(
+                    kind, item_id, e, attempt, self.download_retries, delay))
+                self.metrics.count('download_retries', source='mk', kind=kind)
+                time.sleep(delay)
+                continue
+            part.close(complete=True)
+            part.finish(path)
+            return path, r
+
     def _download_book(self, category: str, book_id: str, convert_format: str) -> MKDocument:
         self.logger.info('download {0} - {1}'.format(category, book_id))
-        if self.pdf_format == 'pass-through':
-            r = requests.post(self.mk_digest_download,
-                              data={'book_sno': book_id, 'book_type': 'pdf'}, cookies=self.cookies,
-                              headers={'referer': self.mk_digest_new_books})
+        record = self._completed_download('book', book_id)
+        if record:
+            path, filename = record['path'], record['filename']
         else:
-            r = requests.post(self.mk_digest_download,
-                              data={'book_sno': book_id, 'book_type': 'doc'}, cookies=self.cookies,
-                              headers={'referer': self.mk_digest_new_books})
-        return MKDocument(book_id=book_id,
-                          filename=re.findall("filename=(.+)", r.headers.get('Content-Disposition'))[0],
-                          category=category, doc=r.content, convert_format=convert_format)
+            if self.pdf_format == 'pass-through':
+                book_type = 'pdf'
+            else:
+                book_type = 'doc'
+            path, r = self._download_to_work_file('book', book_id, 'POST', self.mk_digest_download,
+                                                  data={'book_sno': book_id, 'book_type': book_type},
+                                                  headers={'referer': self.mk_digest_new_books})
+            filename = re.findall("filename=(.+)", r.headers.get('Content-Disposition'))[0]
+            self.checkpoint.mark('mk', 'book', book_id, 'downloaded',
+                                 path=path, size=os.path.getsize(path), filename=filename)
+        return MKDocument(book_id=book_id, filename=filename,
+                          category=category, temp_path=path, convert_format=convert_format)
 
     def _digest_new_audiobook_scrap(self) -> dict:
         contents = self._fetch_new_audiobook_page(self.mk_digest_audiobook_index)
@@ -258,21 +546,17 @@ class MkScraper:
 
     def _digest_all_audiobook_scrap(self) -> dict:
         self.logger.info('scrap all audiobooks...')
-        audiobooks = {}
         categories = self._fetch_audiobook_categories()
-        for name, code in tqdm(categories.items()):
-            self.logger.info('scrap from {0}...'.format(name))
-            audiobooks.update({
-                name: self._digest_book_scrap('{0}?gubun={1}'.format(self.mk_digest_audiobooks, code))
-            })
-        return audiobooks
+        return self._crawl_categories({
+            name: '{0}?gubun={1}'.format(self.mk_digest_audiobooks, code) for name, code in categories.items()
+        })
 
     def _fetch_audiobook_categories(self) -> dict:
         self.logger.info('fetch categories...')
         categories = {}
-        r = requests.get(self.mk_digest_audiobook_index, cookies=self.cookies)
-        raw_categories = BeautifulSoup(r.content, features='html.parser') \
-            .find('div', style=re.compile(r"background: url\(/images/sub/digest_leftmntitle_02.gif\) repeat-y")) \
+        r = self.http.get(self.mk_digest_audiobook_index, lane=LISTING)
+        raw_categories = parse_html(r.content, parse_only=SoupStrainer('div', attrs={'style': category_menu_style})) \
+            .find('div', style=category_menu_style) \
             .find_all('a')
         for c in tqdm(raw_categories):
             try:
@@ -283,8 +567,8 @@ class MkScraper:
         return categories
 
     def _fetch_new_audiobook_page(self, url):
-        r = requests.get(url, cookies=self.cookies)
-        parse = BeautifulSoup(r.content, features='html.parser') \
+        r = self.http.get(url, lane=LISTING)
+        parse = parse_html(r.content, parse_only=SoupStrainer('a')) \
             .find_all('img', class_='bookimg')
         return parse
 
@@ -300,61 +584,192 @@ class MkScraper:
 
     def _download_audiobook(self, category: str, audiobook_id: str) -> MKAudiobook:
         self.logger.info('download start for {0} - {1}'.format(category, audiobook_id))
-        raw_info = requests.get(self.mk_digest_book_detail.format(audiobook_id))
+        raw_info = self.http.get(self.mk_digest_book_detail.format(audiobook_id))
         book_metadata = self._parse_book_metadata(raw_info.content)
         self.logger.info('download metadata for {0} - {1} completed'.format(category, audiobook_id))
-        thumb = requests.get(self.mk_digest_book_thumb.format(audiobook_id))
-        if thumb.status_code == 200:
-            book_metadata['thumb'] = thumb.content
+        thumb = self.images.fetch(self.mk_digest_book_thumb.format(audiobook_id), optimize=False)
+        if thumb:
+            with open(thumb, 'rb') as f:
+                book_metadata['thumb'] = f.read()
             self.logger.info('download thumbnail for {0} - {1} completed'.format(category, audiobook_id))
         self.logger.info('download audio for {0} - {1}'.format(category, audiobook_id))
-        audio = requests.get(self.mk_digest_audiobook_download.format(audiobook_id),
-                             headers={'referer': self._mk_digest_url})
+        audiobook = MKAudiobook(audiobook_id=audiobook_id, metadata=book_metadata, category=category, temp_path=None)
+        record = self._completed_download('audiobook', audiobook_id)
+        if record:
+            audiobook.temp_path = record['path']
+            audiobook.tagged = record.get('tagged', False)
+        else:
+            path, r = self._download_to_work_file('audiobook', audiobook_id, 'GET',
+                                                  self.mk_digest_audiobook_download.format(audiobook_id),
+                                                  id3=audiobook.id3_tag(), headers={'referer': self._mk_digest_url})
+            self.checkpoint.mark('mk', 'audiobook', audiobook_id, 'downloaded',
+                                 path=path, size=os.path.getsize(path), tagged=True)
+            audiobook.temp_path = path
+            audiobook.tagged = True
         self.logger.info('download done for {0} - {1}'.format(category, audiobook_id))
-        return MKAudiobook(audiobook_id=audiobook_id, metadata=book_metadata, audio=audio.content, category=category)
+        return audiobook
+
+    def _push_results(self, filetype: str, item_id: str, results: list):
+        for r in results:
+            if self.on_result:
+                self.on_result(filetype, r)
+            else:
+                with self._lock:
+                    self.result[filetype].append(r)
+        if not self.on_result:
+            # with a result handler the item goes to history once the handler has stored it.
+            with self._lock:
+                self.history[filetype].append(item_id)
 
     def _push_to_result(self, payload):
         self.logger.info('push {0} - {1} to result'.format(payload.type, payload.title))
-        result = payload.convert()
-        if isinstance(result, list):
-            self.result[payload.type] += result
-        else:
-            self.result[payload.type].append(result)
-        self.history[payload.type].append(payload.id)
+        with self.metrics.timer('convert', source='mk', kind=payload.type):
+            result = payload.convert()
+        if not isinstance(result, list):
+            result = [result]
+        result = [r for r in result if r]
+        self.checkpoint.mark('mk', payload.type, payload.id, 'converted', results=result)
+        self._push_results(payload.type, payload.id, result)
+
+    def _resume(self, filetype: str, item_id: str) -> bool:
+        record = self.checkpoint.get('mk', filetype, item_id)
+        if not record:
+            return False
+        if record['stage'] == 'uploaded':
+            self.logger.info('{0} - {1} already uploaded.'.format(filetype, item_id))
+            with self._lock:
+                self.history[filetype].append(item_id)
+            return True
+        if record['stage'] == 'converted' and all(os.path.isfile(r['path']) for r in record['results']):
+            self.logger.info('{0} - {1} already converted.'.format(filetype, item_id))
+            self._push_results(filetype, item_id, record['results'])
+            return True
+        return False
+
+    def _resume_converted(self) -> set:
+        """
+        Push the items a previous run converted but did not upload, whether or not they are in the history,
+        so their work files are uploaded and removed. Records whose files are gone are dropped.
 
-    def _execute_download_books(self, mode):
-        pool = Pool(processes=3)
-        if mode == 'fetch_new':
-            book_task = {'신간': self._digest_book_scrap(self.mk_digest_new_books)}
-        else:
-            book_task = self._digest_all_book_scrap()
+        :return: {(kind, item_id)} pushed
+        """
+        resumed = set()
+        for kind, item_id, record in self.checkpoint.records('mk', 'converted'):
+            if all(os.path.isfile(r['path']) for r in record['results']):
+                self.logger.info('{0} - {1} already converted.'.format(kind, item_id))
+                self._push_results(kind, item_id, record['results'])
+                resumed.add((kind, item_id))
+                continue
+            self.logger.info('{0} - {1} converted files are missing. drop it.'.format(kind, item_id))
+            for r in record['results']:
+                try:
+                    os.remove(r['path'])
+                except OSError:
+                    pass
+            self.checkpoint.mark('mk', kind, item_id, 'dropped')
+        return resumed
+
+    def _drop_fetched_downloads(self) -> None:
+        """
+        Remove downloads and .part leftovers of items that are already in the history.
+        Older leftovers of items no longer listed are pruned by `Checkpoint.finish`.
+        """
+        for kind, item_id, record in self.checkpoint.records('mk', 'downloaded'):
+            if item_id in self.history[kind]:
+                self.logger.info('{0} - {1} already fetched. drop its download.'.format(kind, item_id))
+                self.checkpoint.mark('mk', kind, item_id, 'dropped')
+                part = _PartFile(record['path'] + '.part', None)
+                part.discard(record['path'], part.path, part.meta_path)
+        for entry in os.scandir(self.checkpoint.work_dir):
+            m = re.fullmatch(r'mk-(book|audiobook)-(.+)\.part(?:\.json)?', entry.name)
+            if m and m.group(2) in self.history[m.group(1)]:
+                _PartFile(entry.path, None).discard(entry.path)
+
+    def _download_and_push(self, download, filetype, category, *args):
+        try:
+            if not self._resume(filetype, args[0]):
+                with self.metrics.timer('download', source='mk', kind=filetype):
+                    payload = download(category, *args)
+                self._push_to_result(payload)
+            self.metrics.count('items', source='mk', kind=filetype, result='done')
+            with self._lock:
+                self.errors.pop((filetype, args[0]), None)
+        except Exception as e:
+            self.logger.exception('{0} {1} - {2} failed.'.format(filetype, category, args[0]))
+            with self._lock:
+                error = self.errors.setdefault((filetype, args[0]), {'kind': filetype, 'category': category,
+                                                                     'id': args[0], 'attempts': 0})
+                error['attempts'] += 1
+                error['error'] = '{0}: {1}'.format(type(e).__name__, e)
+                self._retry_queue.append((download, filetype, category) + args)
+
+    def _retry_failed(self, executor) -> None:
+        """
+        Retry queue: failed items get `retry_rounds` more tries after every other item is done.
+        """
+        for retry_round in range(self.retry_rounds):
+            with self._lock:
+                tasks, self._retry_queue = self._retry_queue, []
+            if not tasks:
+                return
+            delay = min(self.download_backoff_max, self.download_backoff * 2 ** (retry_round + 1))
+            self.logger.info('retry {0} failed items in {1:.0f}s...'.format(len(tasks), delay))
+            time.sleep(delay)
+            for task in tasks:
+                self.metrics.count('items', source='mk', kind=task[1], result='retried')
+            wait([executor.submit(self._download_and_push, *task) for task in tasks])
+
+    def _report_errors(self) -> None:
+        for error in self.errors.values():
+            self.metrics.count('items', source='mk', kind=error['kind'], result='failed')
+        if self.errors:
+            self.logger.warning('{0} items failed. they are fetched again next run.\n{1}'.format(
+                len(self.errors), '\n'.join('{kind} {category} - {id} ({attempts} attempts): {error}'.format(**e)
+                                            for e in self.errors.values())))
+
+    def _submit_books(self, executor, mode) -> list:
+        with self.metrics.timer('listing', source='mk', kind='book'):
+            if mode == 'fetch_new':
+                book_task = {'신간': self._digest_book_scrap(self.mk_digest_new_books)}
+            else:
+                book_task = self._digest_all_book_scrap()
+        futures = []
         for category, task in book_task.items():
-            filtered_task = exclude_from_history(task, self.history['book'])
+            filtered_task = [t for t in exclude_from_history(task, self.history['book'])
+                             if ('book', t) not in self._resumed]
             if filtered_task:
                 self.logger.info('start fetch book from category {0}...'.format(category))
                 for t in filtered_task:
                     self.logger.info('start download book {0}...'.format(t))
-                    pool.apply_async(self._download_book, (category, t, self.pdf_format), callback=self._push_to_result)
-        pool.close()
-        pool.join()
-
-    def _execute_download_audiobooks(self, mode):
-        pool = Pool(processes=3)
-        if mode == 'fetch_new':
-            audiobook_task = self._digest_new_audiobook_scrap()
-        else:
-            audiobook_task = self._digest_all_audiobook_scrap()
+                    futures.append(executor.submit(self._download_and_push, self._download_book, 'book',
+                                                   category, t, self.pdf_format))
+        return futures
+
+    def _submit_audiobooks(self, executor, mode) -> list:
+        with self.metrics.timer('listing', source='mk', kind='audiobook'):
+            if mode == 'fetch_new':
+                audiobook_task = self._digest_new_audiobook_scrap()
+            else:
+                audiobook_task = self._digest_all_audiobook_scrap()
+        futures = []
         for category, task in audiobook_task.items():
-            filtered_task = exclude_from_history(task, self.history['audiobook'])
+            filtered_task = [t for t in exclude_from_history(task, self.history['audiobook'])
+                             if ('audiobook', t) not in self._resumed]
             if filtered_task:
                 self.logger.info('start fetch audiobook from category {0}...'.format(category))
                 for t in filtered_task:
                     self.logger.info('start download audiobook {0}...'.format(t))
-                    pool.apply_async(self._download_audiobook, (category, t), callback=self._push_to_result)
-        pool.close()
-        pool.join()
+                    futures.append(executor.submit(self._download_and_push, self._download_audiobook, 'audiobook',
+                                                   category, t))
+        return futures
 
     def execute(self, mode) -> dict:
-        self._execute_download_books(mode)
-        self._execute_download_audiobooks(mode)
+        self._drop_fetched_downloads()
+        self._resumed = self._resume_converted()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = self._submit_books(executor, mode)
+            futures += self._submit_audiobooks(executor, mode)
+            wait(futures)
+            self._retry_failed(executor)
+        self._report_errors()
         return self.result
@@ -1,16 +1,18 @@
 import bs4
 import os.path
-import pdfkit
-import pytz
-import requests
 import tempfile
 import feedparser
 import urllib.parse
-from bs4 import BeautifulSoup
+from bs4 import SoupStrainer
 from datetime import datetime, timezone, timedelta
 
 from concierge.logger import get_logger
-from concierge.scraper.common import Figure, template_path, template_loader, title_normalizer, render_option_us_letter
+from concierge.metrics import get_metrics
+from concierge.scraper.common import Figure, template_path, get_template_loader, title_normalizer
+from concierge.scraper.parser import parse_html
+from concierge.scraper.images import image_cache
+from concierge.scraper.render import render_service
+from concierge.scraper.source import Source
 
 
 class NewYorkerEditorial:
@@ -27,12 +29,11 @@ class NewYorkerEditorial:
         self.body = body
         self.figure = figure
         self.template_path = template_path
-        self.template = template_loader.get_template('new-yorker-editorial.html')
+        self.template = get_template_loader().get_template('new-yorker-editorial.html')
         self.temp_output = tempfile.NamedTemporaryFile(mode='w+b', delete=False)
-        self.temp_image = tempfile.NamedTemporaryFile()
-        if self.figure.image:
-            self.temp_image.write(self.figure.image)
-        self.temp_html = self._render_html()
+        self._rendering = None
+        with get_metrics().timer('render_html', source='new-yorker'):
+            self.temp_html = self._render_html()
 
     def _render_html(self):
         return self.template.render(
@@ -43,7 +44,7 @@ class NewYorkerEditorial:
             article_id=self.id,
             date=self.date,
             article=self.body,
-            figure_img=self.temp_image.name,
+            figure_img=self.figure.path,
             figure_cap=self.figure.caption
         )
 
@@ -54,16 +55,29 @@ class NewYorkerEditorial:
 
         :return:
         """
-        self.temp_output.write(pdfkit.from_string(self.temp_html, output_path=False, options=render_option_us_letter))
-        self.temp_output.close()
+        if not self._rendering:
+            self.temp_output.close()
+            service = render_service()
+            cache_key = service.cache_key(self.temp_html, self.figure.read())
+            self._rendering = service.submit(self.temp_html, self.temp_output.name, cache_key)
+        return self._rendering
+
+    def render(self):
+        """
+        Queue the PDF render without waiting for it.
+
+        :return:
+        """
+        self._render_us_letter()
 
     def develop(self):
         self.logger.info('develop editorial...')
-        self._render_us_letter()
-        return {'path': self.temp_output.name, 'category': 'new-yorker', 'filename': self.filename, 'file_ext': '.pdf'}
+        render_service().result(self._render_us_letter())
+        return {'path': self.temp_output.name, 'category': 'new-yorker', 'id': self.id,
+                'filename': self.filename, 'file_ext': '.pdf'}
 
     def clear(self):
-        self.temp_image.close()
+        pass
 
 
 def _extract_article_id(url: str) -> str:
@@ -77,37 +91,44 @@ def _extract_article_id(url: str) -> str:
     return article_id
 
 
-class NewYorkerScraper:
-    def __init__(self, pdf_format: str):
-        self.logger = get_logger(__name__)
-        self.pdf_format = pdf_format
-        self.timezone = pytz.timezone('US/Eastern')
-        self.today = datetime.now(tz=self.timezone)
-        self._result = {'editorial': []}
+class NewYorkerScraper(Source):
+    name = 'new-yorker'
+    timezone_name = 'US/Eastern'
+
+    def __init__(self, pdf_format: str, on_result=None, history: dict = None):
+        super().__init__(pdf_format, on_result=on_result, history=history)
+        self.images = image_cache()
         self.new_yorker_feed_url = 'https://www.newyorker.com/feed/news/daily-comment'
 
-    def _fetch_editorial_list(self) -> list:
+    def list_items(self) -> list:
         """
         Fetch editorial list by current date.
 
         :return: List of editorial article path.
         """
         editorials = []
-        feed = feedparser.parse(self.new_yorker_feed_url)
+        r = self.http.get_if_changed(self.new_yorker_feed_url, self.validators)
+        if r is None:
+            self.logger.info('editorial list unchanged.')
+            return editorials
+        feed = feedparser.parse(r.content)
         for f in feed['entries']:
             if datetime(*f['published_parsed'][:6], tzinfo=timezone.utc).astimezone(self.timezone).date()\
                     == self.today.date():
                 editorials.append(f['link'])
         return editorials
 
-    def _fetch_editorial_page(self, url: str) -> bs4.element.Tag:
+    def item_id(self, url: str) -> str:
+        return _extract_article_id(url)
+
+    def fetch(self, url: str) -> bs4.element.Tag:
         """
 
         :param url: Url for fetch.
         :return:
         """
-        r = requests.get(url)
-        parse = BeautifulSoup(r.content, features='html.parser').find('article')
+        r = self.http.get(url)
+        parse = parse_html(r.content, parse_only=SoupStrainer('article')).find('article')
         return parse
 
     def _extract_editorial_title(self, contents: bs4.element.Tag) -> str:
@@ -125,19 +146,12 @@ class NewYorkerScraper:
         :param contents:
         :return:
         """
-        image = b''
         figure = contents.find('figure')
         caption = figure.find('figcaption').text
         image_url = figure.find('img').get('src')
         if image_url.startswith('//'):
             image_url = 'https:' + image_url
-        try:
-            r = requests.get(image_url)
-            if r.ok:
-                image = r.content
-        except ConnectionError:
-            pass
-        return Figure(image=image, caption=caption)
+        return Figure(path=self.images.fetch(image_url) or '', caption=caption)
 
     def _extract_editorial_body(self, contents: bs4.element.Tag) -> list:
         """
@@ -152,43 +166,18 @@ class NewYorkerScraper:
                 body.append(p.text)
         return body
 
-    def _fetch_editorial(self, url: str) -> NewYorkerEditorial:
+    def extract(self, url: str, contents: bs4.element.Tag) -> NewYorkerEditorial:
         """
 
         :param url:
+        :param contents:
         :return:
         """
-        self.logger.info('fetch editorial...')
-        article_id = _extract_article_id(url)
-        contents = self._fetch_editorial_page(url)
         title = self._extract_editorial_title(contents)
         body = self._extract_editorial_body(contents)
         figure = self._extract_editorial_figure(contents)
-        return NewYorkerEditorial(url=url, article_id=article_id, article_date=self.today.date(),
-                              title=title, body=body, figure=figure)
-
-    def _push_to_result(self, payload) -> None:
-        """
-
-        :param payload:
-        :return:
-        """
-        self.logger.info('push to result article {0}'.format(payload.id))
-        result = payload.develop()
-        if result:
-            self._result[payload.type].append(result)
-        payload.clear()
-
-    def download_editorials(self) -> dict:
-        """
-
-        :return:
-        """
-        self.logger.info('download editorials from New Yorker...')
-        articles = self._fetch_editorial_list()
-        if articles:
-            for a in articles:
-                self._push_to_result(self._fetch_editorial(a))
-        return self._result
-
+        return NewYorkerEditorial(url=url, article_id=_extract_article_id(url), article_date=self.today.date(),
+                                   title=title, body=body, figure=figure)
 
+    def commit(self) -> None:
+        self.validators.commit(self.new_yorker_feed_url)
@@ -0,0 +1,29 @@
+import os
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+
+def _default_features() -> str:
+    features = os.environ.get('PDFC_HTML_PARSER')
+    if features:
+        return features
+    try:
+        import lxml
+        return 'lxml'
+    except ImportError:
+        return 'html.parser'
+
+
+html_parser = _default_features()
+
+
+def parse_html(content, parse_only: SoupStrainer = None, features: str = None) -> BeautifulSoup:
+    """
+    Parse html with the configured backend (lxml when available, PDFC_HTML_PARSER to override).
+
+    :param content:
+    :param parse_only: only build the subtrees matching this strainer.
+    :param features: parser backend for this call.
+    :return:
+    """
+    return BeautifulSoup(content, features=features or html_parser, parse_only=parse_only)
@@ -0,0 +1,291 @@
+import hashlib
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import Future
+
+from concierge.config import env_int, env_float, cache_dir
+from concierge.logger import get_logger
+from concierge.metrics import get_metrics
+from concierge.scraper.common import render_option_us_letter
+
+
+def _option_args(options: dict) -> list:
+    args = []
+    for key, value in options.items():
+        args.append(key if key.startswith('--') else '--{0}'.format(key))
+        if value is not None:
+            args.append(str(value))
+    return args
+
+
+class RenderCache:
+    def __init__(self, path: str, max_size: int):
+        """
+        On-disk PDF cache with size-bounded LRU eviction.
+        File mtime is the last use time.
+
+        :param path: cache directory.
+        :param max_size: max total bytes. 0 disables the cache.
+        """
+        self.logger = get_logger(__name__)
+        self.path = path
+        self.max_size = max_size
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(html: str, options: dict, *blobs) -> str:
+        """
+
+        :param html: rendered html without volatile temp paths.
+        :param options: render options.
+        :param blobs: other inputs of the render, such as figure image bytes.
+        :return:
+        """
+        h = hashlib.sha256(html.encode('utf-8'))
+        for blob in blobs:
+            h.update(hashlib.sha256(blob or b'').digest())
+        h.update(repr(sorted(options.items())).encode('utf-8'))
+        return h.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.path, '{0}.pdf'.format(key))
+
+    def get(self, key: str, output_path: str) -> bool:
+        if not self.max_size:
+            return False
+        cached = self._path(key)
+        try:
+            shutil.copyfile(cached, output_path)
+            os.utime(cached)
+        except OSError:
+            return False
+        self.logger.info('render cache hit {0}'.format(key))
+        return True
+
+    def put(self, key: str, output_path: str) -> None:
+        if not self.max_size:
+            return
+        cached = self._path(key)
+        tmp = '{0}.{1}.tmp'.format(cached, threading.get_ident())
+        shutil.copyfile(output_path, tmp)
+        os.replace(tmp, cached)
+        self._evict()
+
+    def _evict(self) -> None:
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.path):
+                if not name.endswith('.pdf'):
+                    continue
+                try:
+                    st = os.stat(os.path.join(self.path, name))
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, name))
+            total = sum(e[1] for e in entries)
+            for mtime, size, name in sorted(entries):
+                if total <= self.max_size:
+                    break
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except OSError:
+                    pass
+                total -= size
+
+
+class RenderService:
+    def __init__(self, options: dict, workers: int = 2, batch_size: int = 4, binary: str = None,
+                 cache: RenderCache = None, timeout: float = 60, wait_timeout: float = 600):
+        """
+        Bounded pool of render workers in front of wkhtmltopdf.
+        Each worker takes up to `batch_size` queued articles and renders them
+        with one wkhtmltopdf process (--read-args-from-stdin),
+        so Qt/WebKit start up once per batch instead of once per article.
+
+        :param options: wkhtmltopdf options, e.g. {'page-size': 'Letter', 'no-outline': None}.
+        :param workers: render worker count.
+        :param batch_size: max articles per wkhtmltopdf invocation.
+        :param binary: wkhtmltopdf path. looked up in PATH when omitted.
+        :param cache: render cache. renders with a cache key are looked up first.
+        :param timeout: seconds per article a wkhtmltopdf process may take. a batch gets it times its size.
+        :param wait_timeout: seconds `result` waits for a render, queueing included.
+        """
+        self.logger = get_logger(__name__)
+        self.options = options
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.binary = binary or os.environ.get('PDFC_WKHTMLTOPDF') or shutil.which('wkhtmltopdf')
+        self.cache = cache
+        self.timeout = timeout
+        self.wait_timeout = wait_timeout
+        self.queue = queue.Queue()
+        self.metrics = get_metrics()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._work, name='render-{0}'.format(i), daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def cache_key(self, html: str, *blobs) -> str:
+        return RenderCache.key(html, self.options, *blobs)
+
+    def submit(self, html: str, output_path: str, cache_key: str = None) -> Future:
+        """
+
+        :param html: rendered html.
+        :param output_path: pdf path to write.
+        :param cache_key: RenderCache.key of the render. skip wkhtmltopdf on a cache hit.
+        :return: future resolved with output_path.
+        """
+        future = Future()
+        if cache_key and self.cache and self.cache.get(cache_key, output_path):
+            self.metrics.count('render_cache', result='hit')
+            future.set_result(output_path)
+            return future
+        if cache_key and self.cache:
+            self.metrics.count('render_cache', result='miss')
+        self._start()
+        self.queue.put((html, output_path, cache_key, future))
+        self.metrics.gauge('queue_depth', self.queue.qsize(), queue='render')
+        return future
+
+    def result(self, future: Future) -> str:
+        """
+        Wait for a submitted render.
+
+        :param future: output of `submit`.
+        :return: output_path
+        :raise concurrent.futures.TimeoutError: the render did not finish within `wait_timeout`.
+        """
+        return future.result(timeout=self.wait_timeout)
+
+    def render(self, html: str, output_path: str, cache_key: str = None) -> str:
+        return self.result(self.submit(html, output_path, cache_key))
+
+    def _resolve(self, job, error=None):
+        html, output_path, cache_key, future = job
+        if error:
+            future.set_exception(error)
+            return
+        if cache_key and self.cache:
+            try:
+                self.cache.put(cache_key, output_path)
+            except OSError:
+                self.logger.exception('render cache write failed.')
+        future.set_result(output_path)
+
+    def _take_batch(self) -> list:
+        jobs = [self.queue.get()]
+        while len(jobs) < self.batch_size:
+            try:
+                jobs.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return jobs
+
+    def _work(self):
+        while True:
+            jobs = self._take_batch()
+            try:
+                with self.metrics.timer('render_pdf'):
+                    self._render_batch(jobs)
+                self.metrics.count('rendered', len(jobs))
+            except Exception as e:
+                for job in jobs:
+                    if not job[3].done():
+                        job[3].set_exception(e)
+
+    def _run(self, args: list, timeout: float, stdin: bytes = None) -> bool:
+        """
+
+        :return: True when wkhtmltopdf exited cleanly within the timeout.
+        """
+        try:
+            p = subprocess.run([self.binary, '--quiet'] + _option_args(self.options) + args, input=stdin,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self.logger.warning('wkhtmltopdf timed out after {0:.1f}s.'.format(timeout))
+            self.metrics.count('render_failed', reason='timeout')
+            return False
+        if p.returncode:
+            self.logger.warning('wkhtmltopdf exited with code {0}.'.format(p.returncode))
+            self.metrics.count('render_failed', reason='exit')
+            return False
+        return True
+
+    def _render_alone(self, html_path: str, output_path: str) -> None:
+        """
+        Any failure fails the render, the output may be truncated. The output is emptied first,
+        so a partial output of a failed batch is not taken for this render.
+        """
+        if not self.binary:
+            raise OSError('wkhtmltopdf not found.')
+        open(output_path, 'wb').close()
+        if not self._run([html_path, output_path], self.timeout):
+            raise OSError('wkhtmltopdf failed to render {0}.'.format(output_path))
+
+    def _render_batch(self, jobs: list):
+        work_dir = tempfile.mkdtemp(prefix='pdfc-render-')
+        try:
+            lines = []
+            batched = []
+            html_paths = []
+            for i, (html, output_path, cache_key, future) in enumerate(jobs):
+                html_path = os.path.join(work_dir, '{0}.html'.format(i))
+                with open(html_path, 'w', encoding='utf-8') as f:
+                    f.write(html)
+                html_paths.append(html_path)
+                if any(c.isspace() for c in output_path):
+                    continue  # stdin arguments are split on whitespace
+                lines.append('{0} {1}\n'.format(html_path, output_path))
+                batched.append(i)
+            if batched and self.binary:
+                if not self._run(['--read-args-from-stdin'], self.timeout * len(batched),
+                                 stdin=''.join(lines).encode('utf-8')):
+                    # outputs of a killed or failed batch may be truncated. render each article alone.
+                    batched = []
+            for i, job in enumerate(jobs):
+                output_path = job[1]
+                if i in batched and os.path.isfile(output_path) and os.path.getsize(output_path) > 0:
+                    self._resolve(job)
+                    continue
+                self.logger.info('batch render missed {0}. render alone.'.format(output_path))
+                try:
+                    self._render_alone(html_paths[i], output_path)
+                except Exception as e:
+                    self._resolve(job, e)
+                    continue
+                self._resolve(job)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+_render_service = None
+_render_service_lock = threading.Lock()
+
+
+def render_service() -> RenderService:
+    """
+    Process-wide US Letter render service.
+    """
+    global _render_service
+    with _render_service_lock:
+        if _render_service is None:
+            cache = RenderCache(cache_dir('render'), env_int('PDFC_RENDER_CACHE_SIZE', 256 * 1024 * 1024))
+            _render_service = RenderService(render_option_us_letter,
+                                            workers=env_int('PDFC_RENDER_WORKERS', 2),
+                                            batch_size=env_int('PDFC_RENDER_BATCH', 4),
+                                            cache=cache,
+                                            timeout=env_float('PDFC_RENDER_TIMEOUT', 60),
+                                            wait_timeout=env_float('PDFC_RENDER_WAIT_TIMEOUT', 600))
+        return _render_service
@@ -0,0 +1,200 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pytz
+
+from concierge.config import env_int
+from concierge.logger import get_logger
+from concierge.metrics import get_metrics
+from concierge.network import shared_client, validator_cache
+
+
+class Source:
+    """
+    Base of the source plugins.
+    A source lists the items of the day, fetches and extracts each of them into a payload
+    and renders the payload. `SourceEngine` drives those steps, so a source only implements them.
+
+    Payloads have `type`, `id`, `render()`, `develop()` and `clear()` like the editorial classes.
+    """
+    # source name. also the history, checkpoint and metrics label.
+    name = None
+    # history kinds the source records.
+    history_kinds = ('editorial',)
+    timezone_name = 'UTC'
+
+    def __init__(self, pdf_format: str, on_result=None, history: dict = None):
+        self.logger = get_logger(type(self).__module__)
+        self.pdf_format = pdf_format
+        self.on_result = on_result
+        self.history = history if history else {kind: [] for kind in self.history_kinds}
+        self.http = shared_client()
+        self.validators = validator_cache()
+        self.metrics = get_metrics()
+        self.timezone = pytz.timezone(self.timezone_name)
+        self.today = datetime.now(tz=self.timezone)
+        self._result = {kind: [] for kind in self.history_kinds}
+        # (kind, id) handed to `on_result` in this run, and whether every listed item got that far.
+        self.pushed = []
+        self.complete = False
+
+    def reset(self, history: dict = None) -> None:
+        """
+        Prepare for another run in the same process.
+
+        :param history: staged history for the run. kept when omitted.
+        :return:
+        """
+        self.today = datetime.now(tz=self.timezone)
+        self._result = {kind: [] for kind in self.history_kinds}
+        self.pushed = []
+        self.complete = False
+        if history is not None:
+            self.history = history
+
+    def list_items(self) -> list:
+        """
+        Items to fetch in this run. already fetched ones are dropped by the engine.
+
+        :return: list of item references, e.g. urls.
+        """
+        raise NotImplementedError
+
+    def item_id(self, item) -> str:
+        """
+
+        :param item: item reference from `list_items`.
+        :return: id recorded in the history.
+        """
+        return str(item)
+
+    def fetch(self, item):
+        """
+
+        :param item: item reference from `list_items`.
+        :return: fetched contents.
+        """
+        raise NotImplementedError
+
+    def extract(self, item, contents):
+        """
+
+        :param item: item reference from `list_items`.
+        :param contents: output of `fetch`.
+        :return: payload.
+        """
+        raise NotImplementedError
+
+    def render(self, payload) -> None:
+        """
+        Queue the render of the payload without waiting for it.
+
+        :param payload:
+        :return:
+        """
+        payload.render()
+
+    def commit(self) -> None:
+        """
+        Called after a run without failed items, e.g. to commit listing validators.
+        With `on_result` the caller calls it once every pushed item is stored.
+
+        :return:
+        """
+        pass
+
+    def push(self, payload) -> None:
+        """
+
+        :param payload:
+        :return:
+        """
+        self.logger.info('push to result article {0}'.format(payload.id))
+        with self.metrics.timer('render_wait', source=self.name):
+            result = payload.develop()
+        if result:
+            if self.on_result:
+                # the handler records the history once the result is stored, so it needs the id.
+                self.on_result(payload.type, dict({'id': payload.id}, **result))
+                self.pushed.append((payload.type, payload.id))
+            else:
+                self._result[payload.type].append(result)
+                self.history[payload.type].append(payload.id)
+            self.metrics.count('items', source=self.name, kind=payload.type, result='done')
+        payload.clear()
+
+    def download_editorials(self) -> dict:
+        """
+
+        :return:
+        """
+        self.logger.info('download from {0}...'.format(self.name))
+        return SourceEngine(workers=env_int('PDFC_SOURCE_WORKERS', 4)).run(self)
+
+
+class SourceEngine:
+    def __init__(self, workers: int = 4):
+        """
+        Runs a source: listing, then fetch, extract and render of the items in parallel.
+        Results are pushed in listing order.
+
+        :param workers: max items fetched at once.
+        """
+        self.logger = get_logger(__name__)
+        self.metrics = get_metrics()
+        self.workers = max(1, workers)
+
+    def _prepare(self, source: Source, item):
+        self.logger.info('fetch {0} {1}...'.format(source.name, source.item_id(item)))
+        with self.metrics.timer('fetch', source=source.name):
+            contents = source.fetch(item)
+        with self.metrics.timer('extract', source=source.name):
+            payload = source.extract(item, contents)
+        source.render(payload)
+        return payload
+
+    def pending(self, source: Source, items: list) -> list:
+        """
+
+        :param source:
+        :param items:
+        :return: items not in the history, without duplicates.
+        """
+        seen = set()
+        pending = []
+        for item in items:
+            item_id = source.item_id(item)
+            if item_id in seen or any(item_id in source.history.get(kind, ()) for kind in source.history_kinds):
+                continue
+            seen.add(item_id)
+            pending.append(item)
+        return pending
+
+    def run(self, source: Source) -> dict:
+        """
+
+        :param source:
+        :return: result of the source. empty when results go to `on_result`.
+        """
+        with self.metrics.timer('listing', source=source.name):
+            items = self.pending(source, source.list_items())
+        failed = 0
+        if items:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(items)),
+                                    thread_name_prefix='source-{0}'.format(source.name)) as executor:
+                futures = [executor.submit(self._prepare, source, item) for item in items]
+                for item, future in zip(items, futures):
+                    try:
+                        source.push(future.result())
+                    except Exception:
+                        failed += 1
+                        self.logger.exception('{0} {1} failed.'.format(source.name, source.item_id(item)))
+                        self.metrics.count('items', source=source.name, kind=source.history_kinds[0],
+                                           result='failed')
+        source.complete = not failed
+        if failed:
+            # keep the listing validators, the failed items are listed again next run.
+            self.logger.info('{0}: {1} of {2} items failed.'.format(source.name, failed, len(items)))
+        elif not source.on_result:
+            source.commit()
+        return source._result
@@ -1,15 +1,16 @@
 import bs4
 import os.path
-import pdfkit
-import pytz
-import requests
 import tempfile
 import urllib.parse
-from bs4 import BeautifulSoup
+from bs4 import SoupStrainer
 from datetime import datetime, timezone, timedelta
 
 from concierge.logger import get_logger
-from concierge.scraper.common import template_path, template_loader, title_normalizer, render_option_us_letter
+from concierge.metrics import get_metrics
+from concierge.scraper.common import template_path, get_template_loader, title_normalizer
+from concierge.scraper.parser import parse_html
+from concierge.scraper.render import render_service
+from concierge.scraper.source import Source
 
 
 class YomiuriEditorial:
@@ -25,9 +26,11 @@ class YomiuriEditorial:
         self.filename = '{1}_{0}'.format(title_normalizer(self.title).replace(' ', '-').replace('　', '-'), self.date)
         self.body = body
         self.template_path = template_path
-        self.template = template_loader.get_template('yomiuri-editorial.html')
+        self.template = get_template_loader().get_template('yomiuri-editorial.html')
         self.temp_output = tempfile.NamedTemporaryFile(mode='w+b', delete=False)
-        self.temp_html = self._render_html()
+        self._rendering = None
+        with get_metrics().timer('render_html', source='yomiuri'):
+            self.temp_html = self._render_html()
 
     def _render_html(self):
         return self.template.render(
@@ -47,13 +50,29 @@ class YomiuriEditorial:
 
         :return:
         """
-        self.temp_output.write(pdfkit.from_string(self.temp_html, output_path=False, options=render_option_us_letter))
-        self.temp_output.close()
+        if not self._rendering:
+            self.temp_output.close()
+            service = render_service()
+            self._rendering = service.submit(self.temp_html, self.temp_output.name,
+                                             service.cache_key(self.temp_html))
+        return self._rendering
+
+    def render(self):
+        """
+        Queue the PDF render without waiting for it.
+
+        :return:
+        """
+        self._render_us_letter()
 
     def develop(self):
         self.logger.info('develop editorial...')
-        self._render_us_letter()
-        return {'path': self.temp_output.name, 'category': 'yomiuri', 'filename': self.filename, 'file_ext': '.pdf'}
+        render_service().result(self._render_us_letter())
+        return {'path': self.temp_output.name, 'category': 'yomiuri', 'id': self.id,
+                'filename': self.filename, 'file_ext': '.pdf'}
+
+    def clear(self):
+        pass
 
 
 def _extract_article_id(url: str) -> str:
@@ -67,25 +86,27 @@ def _extract_article_id(url: str) -> str:
     return article_id
 
 
-class YomiuriScraper:
-    def __init__(self, pdf_format: str):
-        self.logger = get_logger(__name__)
-        self.pdf_format = pdf_format
-        self.timezone = pytz.timezone('Asia/Tokyo')
-        self.today = datetime.now(tz=self.timezone)
-        self._result = {'editorial': []}
+class YomiuriScraper(Source):
+    name = 'yomiuri'
+    timezone_name = 'Asia/Tokyo'
+
+    def __init__(self, pdf_format: str, on_result=None, history: dict = None):
+        super().__init__(pdf_format, on_result=on_result, history=history)
         self._yomiuri_news_url = 'https://www.yomiuri.co.jp'
         self.yomiuri_editorials_url = self._yomiuri_news_url + '/editorial'
 
-    def _fetch_editorial_list(self) -> list:
+    def list_items(self) -> list:
         """
         Fetch editorial list by current date.
 
         :return: List of editorial article path.
         """
         editorials = []
-        r = requests.get(self.yomiuri_editorials_url)
-        soup = BeautifulSoup(r.content, "html.parser")
+        r = self.http.get_if_changed(self.yomiuri_editorials_url, self.validators)
+        if r is None:
+            self.logger.info('editorial list unchanged.')
+            return editorials
+        soup = parse_html(r.content, parse_only=SoupStrainer('div', attrs={'class': 'uni-news-editorial-jp'}))
         for article in soup.find('div', class_='uni-news-editorial-jp').find_all('time'):
             if datetime.fromisoformat(article['datetime']).date() == self.today.date():
                 article_link = article.parent.parent.find('a').get('href')
@@ -93,14 +114,17 @@ class YomiuriScraper:
                     editorials.append(article_link)
         return editorials
 
-    def _fetch_editorial_page(self, url: str) -> bs4.element.Tag:
+    def item_id(self, url: str) -> str:
+        return _extract_article_id(url)
+
+    def fetch(self, url: str) -> bs4.element.Tag:
         """
 
         :param url: Url for fetch.
         :return:
         """
-        r = requests.get(url)
-        parse = BeautifulSoup(r.content, features='html.parser').find('article')
+        r = self.http.get(url)
+        parse = parse_html(r.content, parse_only=SoupStrainer('article')).find('article')
         return parse
 
     def _extract_editorial_title(self, contents: bs4.element.Tag) -> str:
@@ -125,39 +149,17 @@ class YomiuriScraper:
                 body.append(p.text)
         return body
 
-    def _fetch_editorial(self, url: str) -> YomiuriEditorial:
+    def extract(self, url: str, contents: bs4.element.Tag) -> YomiuriEditorial:
         """
 
         :param url:
+        :param contents:
         :return:
         """
-        self.logger.info('fetch editorial...')
-        article_id = _extract_article_id(url)
-        contents = self._fetch_editorial_page(url)
         title = self._extract_editorial_title(contents)
         body = self._extract_editorial_body(contents)
-        return YomiuriEditorial(url=url, article_id=article_id, article_date=self.today.date(),
-                              title=title, body=body)
-
-    def _push_to_result(self, payload) -> None:
-        """
-
-        :param payload:
-        :return:
-        """
-        self.logger.info('push to result article {0}'.format(payload.id))
-        result = payload.develop()
-        if result:
-            self._result[payload.type].append(result)
-
-    def download_editorials(self) -> dict:
-        """
+        return YomiuriEditorial(url=url, article_id=_extract_article_id(url), article_date=self.today.date(),
+                                title=title, body=body)
 
-        :return:
-        """
-        self.logger.info('download editorials from Yomiuri...')
-        articles = self._fetch_editorial_list()
-        if articles:
-            for a in articles:
-                self._push_to_result(self._fetch_editorial(a))
-        return self._result
+    def commit(self) -> None:
+        self.validators.commit(self.yomiuri_editorials_url)
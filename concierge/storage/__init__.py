@@ -1,16 +1,27 @@
-import yaml
+import importlib
+import threading
+import uuid
+from datetime import datetime
 
+from ..config import env_int
 from ..logger import get_logger
+from ..metrics import get_metrics
+from .common import content_hash
+from .history import HistoryStore
 
 
 class Storage(object):
     def __init__(self, storage_type, storage_token):
         self.logger = get_logger(__name__)
+        self.metrics = get_metrics()
         self.type = storage_type
         self.token = storage_token
         self.chunk_size = 0
-        self.history = {}
+        self.history = HistoryStore()
         self.history_path = None
+        self.history_segments = []
+        self.history_segment_limit = env_int('PDFC_HISTORY_SEGMENTS', 32)
+        self._history_lock = threading.Lock()
         self.upload_path = None
         self.provider = None
 
@@ -20,20 +31,134 @@ class Storage(object):
     def upload(self, file, path):
         pass
 
-    def fetch_history(self):
+    def upload_batch(self, files):
+        """
+
+        :param files: [(filetype, file_result), ...]
+        :return: uploaded files
+        """
+        for filetype, file_result in files:
+            self.upload(file_result, filetype)
+        return files
+
+    def _remote_hash(self, filetype, file_result):
+        """
+        Content hash of the file already stored at the upload destination.
+
+        :return: hex digest or None if there is no such file.
+        """
+        return None
+
+    def clear_remote_cache(self):
+        """
+        Forget cached remote listings, so the next run sees changes made meanwhile.
+        """
         pass
 
-    def push_history(self):
+    def is_uploaded(self, filetype, file_result) -> bool:
+        remote = self._remote_hash(filetype, file_result)
+        return remote is not None and remote == content_hash(file_result['path'])
+
+    def exclude_uploaded(self, files) -> list:
+        """
+        Drop files whose identical copy is already at the destination.
+
+        :param files: [(filetype, file_result), ...]
+        :return: files to upload
+        """
+        pending = []
+        for filetype, file_result in files:
+            if self.is_uploaded(filetype, file_result):
+                self.logger.info('{0}{1} unchanged. skip upload.'.format(
+                    file_result['filename'], file_result['file_ext']))
+            else:
+                pending.append((filetype, file_result))
+        return pending
+
+    def _read_data(self, name):
+        """
+
+        :param name: path relative to the data directory.
+        :return: bytes or None if missing.
+        """
+        return None
+
+    def _write_data(self, name, payload: bytes):
         pass
 
-    def read_history(self, history_file):
-        with open(history_file, 'r') as stream:
-            h = yaml.load(stream, Loader=yaml.Loader)
-            self.history = h if h else {}
+    def _list_data(self, folder) -> list:
+        return []
+
+    def _delete_data(self, name):
+        pass
+
+    def fetch_history(self):
+        """
+        Load every history journal segment.
+        When there is none yet, migrate the legacy history.yml once.
+        """
+        if not self.connected():
+            return
+        with self.metrics.timer('history_fetch', storage=self.type):
+            self.history_segments = sorted(self._list_data('history'))
+            if self.history_segments:
+                for name in self.history_segments:
+                    payload = self._read_data('history/{0}'.format(name))
+                    if payload:
+                        self.history.load(payload.decode('utf-8'))
+            else:
+                legacy = self._read_data('history.yml')
+                if legacy:
+                    import yaml
+                    self.logger.info('migrate history.yml to history journal.')
+                    h = yaml.load(legacy, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+                    self.history.load_dict(h if h else {})
+
+    def push_history(self):
+        """
+        Write pending history entries as a new journal segment.
+        Segments are compacted into one when there are too many.
+        Only the entries written are cleared, so entries added meanwhile by another run wait for the next push.
+        """
+        if not self.connected():
+            return
+        with self._history_lock, self.metrics.timer('history_push', storage=self.type):
+            pending = self.history.pending
+            segment = '{0:%Y%m%d%H%M%S%f}-{1}.log'.format(datetime.utcnow(), uuid.uuid4().hex[:8])
+            if len(self.history_segments) >= self.history_segment_limit:
+                self.logger.info('compact history journal.')
+                self._write_data('history/{0}'.format(segment), self.history.dump().encode('utf-8'))
+                for name in self.history_segments:
+                    self._delete_data('history/{0}'.format(name))
+                self.history_segments = [segment]
+            elif pending:
+                self._write_data('history/{0}'.format(segment), self.history.dump(pending).encode('utf-8'))
+                self.history_segments.append(segment)
+            self.history.clear_pending(len(pending))
+
+
+# storage type: (module, storage class). modules are imported only when the backend is used.
+storage_backends = {
+    'local': ('concierge.storage.local', 'LocalStorage'),
+    'dropbox': ('concierge.storage.dropbox', 'DropboxStorage')
+}
+
+
+def load_storage(storage_type: str):
+    """
 
-    def dump_history(self):
-        return yaml.dump(self.history)
+    :param storage_type:
+    :return: Storage subclass
+    """
+    try:
+        module, name = storage_backends[storage_type]
+    except KeyError:
+        raise ValueError('unknown storage type {0}'.format(storage_type))
+    return getattr(importlib.import_module(module), name)
 
 
-from .local import LocalStorage
-from .dropbox import DropboxStorage
+def __getattr__(name):
+    for module, cls in storage_backends.values():
+        if cls == name:
+            return getattr(importlib.import_module(module), cls)
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
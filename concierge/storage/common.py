@@ -0,0 +1,22 @@
+import hashlib
+
+content_hash_block_size = 4 * 1024 * 1024
+
+
+def content_hash(path) -> str:
+    """
+    Dropbox content hash of a local file.
+    SHA-256 of the concatenated SHA-256 digests of every 4 MiB block,
+    computed while streaming the file.
+
+    :param path:
+    :return: hex digest
+    """
+    blocks = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(content_hash_block_size)
+            if not block:
+                break
+            blocks.update(hashlib.sha256(block).digest())
+    return blocks.hexdigest()
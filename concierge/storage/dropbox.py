@@ -1,8 +1,12 @@
 import os.path
-import tempfile
+import posixpath
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import dropbox
 from tqdm import tqdm
+from concierge.config import env_int
 from concierge.storage import Storage
 
 
@@ -14,8 +18,12 @@ class DropboxStorage(Storage):
     def __init__(self, storage_type, storage_token):
         super().__init__(storage_type, storage_token)
         self.provider = dropbox.Dropbox(self.token)
-        self.chunk_size = 4 * 1024 * 1024
+        self.chunk_size = env_int('PDFC_DROPBOX_CHUNK_SIZE', 4 * 1024 * 1024)
+        self.upload_workers = env_int('PDFC_DROPBOX_UPLOAD_WORKERS', 4)
+        self.batch_limit = 1000
         self.write_mode = dropbox.dropbox_client.files.WriteMode.overwrite
+        self._folder_hashes = {}
+        self._folder_lock = threading.Lock()
 
     def connected(self):
         payload = 'ping'
@@ -29,18 +37,19 @@ class DropboxStorage(Storage):
 
     def upload(self, file_result, filetype):
         size = os.path.getsize(file_result['path'])
+        self.metrics.count('bytes', size, direction='out', host='dropbox')
         with open(file_result['path'], 'rb') as f:
             if size <= self.chunk_size:
-                self.logger.info(
-                    self.provider.files_upload(
-                        f=f.read(),
-                        path='/{0}/{1}/{2}{3}'.format(
-                            filetype, file_result['category'],
-                            file_result['filename'], file_result['file_ext']
-                        ),
-                        mode=self.write_mode
-                    )
+                metadata = self.provider.files_upload(
+                    f=f.read(),
+                    path='/{0}/{1}/{2}{3}'.format(
+                        filetype, file_result['category'],
+                        file_result['filename'], file_result['file_ext']
+                    ),
+                    mode=self.write_mode
                 )
+                self.logger.info(metadata)
+                self._remember_hash(metadata)
             else:
                 with tqdm(total=size) as progress:
                     upload_session = self.provider.files_upload_session_start(
@@ -60,11 +69,11 @@ class DropboxStorage(Storage):
                     )
                     while f.tell() < size:
                         if (size - f.tell()) <= self.chunk_size:
-                            self.logger.info(
-                                self.provider.files_upload_session_finish(
-                                    f.read(self.chunk_size), cursor, upload_commit
-                                )
+                            metadata = self.provider.files_upload_session_finish(
+                                f.read(self.chunk_size), cursor, upload_commit
                             )
+                            self.logger.info(metadata)
+                            self._remember_hash(metadata)
                             break
                         else:
                             self.provider.files_upload_session_append_v2(
@@ -74,21 +83,148 @@ class DropboxStorage(Storage):
                             cursor.offset = f.tell()
                         progress.update(self.chunk_size)
 
-    def fetch_history(self):
-        if self.connected():
-            self.logger.info('fetch history from dropbox...')
-            try:
-                meta, r = self.provider.files_download('/data/history.yml')
-                h = tempfile.NamedTemporaryFile()
-                h.write(r.content)
-                h.flush()
-                self.read_history(h.name)
-                h.close()
-            except dropbox.exceptions.ApiError:
-                return None
-
-    def push_history(self):
-        if self.connected():
-            payload = self.dump_history()
-            self.provider.files_upload(f=payload.encode('utf-8'), path='/data/history.yml',
-                                       mode=dropbox.dropbox_client.files.WriteMode.overwrite)
+    def _upload_path(self, filetype, file_result):
+        return '/{0}/{1}/{2}{3}'.format(
+            filetype, file_result['category'], file_result['filename'], file_result['file_ext'])
+
+    def _list_folder_hashes(self, folder) -> dict:
+        hashes = {}
+        try:
+            r = self.provider.files_list_folder(folder)
+        except dropbox.exceptions.ApiError:
+            return hashes
+        while True:
+            for entry in r.entries:
+                if isinstance(entry, dropbox.dropbox_client.files.FileMetadata):
+                    hashes[entry.path_lower] = entry.content_hash
+            if not r.has_more:
+                return hashes
+            r = self.provider.files_list_folder_continue(r.cursor)
+
+    def _remote_hash(self, filetype, file_result):
+        path = self._upload_path(filetype, file_result).lower()
+        folder = posixpath.dirname(path)
+        with self._folder_lock:
+            if folder not in self._folder_hashes:
+                self._folder_hashes[folder] = self._list_folder_hashes(folder)
+            return self._folder_hashes[folder].get(path)
+
+    def _remember_hash(self, metadata) -> None:
+        """
+        Keep the listing cache in step with a file just written.
+
+        :param metadata: FileMetadata of the upload.
+        """
+        folder = posixpath.dirname(metadata.path_lower)
+        with self._folder_lock:
+            if folder in self._folder_hashes:
+                self._folder_hashes[folder][metadata.path_lower] = metadata.content_hash
+
+    def clear_remote_cache(self):
+        with self._folder_lock:
+            self._folder_hashes = {}
+
+    def _upload_session(self, filetype, file_result):
+        """
+        Upload a file through a closed upload session without committing it.
+
+        :return: finish argument for files_upload_session_finish_batch
+        """
+        size = os.path.getsize(file_result['path'])
+        self.metrics.count('bytes', size, direction='out', host='dropbox')
+        with open(file_result['path'], 'rb') as f:
+            upload_session = self.provider.files_upload_session_start(
+                f=f.read(self.chunk_size), close=f.tell() >= size
+            )
+            cursor = dropbox.dropbox_client.files.UploadSessionCursor(
+                session_id=upload_session.session_id,
+                offset=f.tell()
+            )
+            while f.tell() < size:
+                self.provider.files_upload_session_append_v2(
+                    f.read(self.chunk_size), cursor, close=f.tell() >= size
+                )
+                cursor.offset = f.tell()
+        commit = dropbox.dropbox_client.files.CommitInfo(
+            path=self._upload_path(filetype, file_result), mode=self.write_mode
+        )
+        return dropbox.dropbox_client.files.UploadSessionFinishArg(cursor=cursor, commit=commit)
+
+    def _try_upload_session(self, file):
+        """
+
+        :param file: (filetype, file_result)
+        :return: output of `_upload_session` or None when the upload failed.
+        """
+        filetype, file_result = file
+        try:
+            return self._upload_session(filetype, file_result)
+        except Exception:
+            self.logger.exception('upload {0} failed.'.format(file_result['path']))
+            return None
+
+    def _finish_batch(self, entries):
+        self.metrics.count('dropbox_batches')
+        launch = self.provider.files_upload_session_finish_batch(entries)
+        if launch.is_async_job_id():
+            job_id = launch.get_async_job_id()
+            status = self.provider.files_upload_session_finish_batch_check(job_id)
+            while status.is_in_progress():
+                time.sleep(1)
+                status = self.provider.files_upload_session_finish_batch_check(job_id)
+            result = status.get_complete()
+        else:
+            result = launch.get_complete()
+        succeeded = []
+        for i, r in enumerate(result.entries):
+            if r.is_failure():
+                self.logger.info('upload {0} failed. {1}'.format(entries[i].commit.path, r.get_failure()))
+            else:
+                self.logger.info(r.get_success())
+                self._remember_hash(r.get_success())
+                succeeded.append(i)
+        return succeeded
+
+    def upload_batch(self, files):
+        """
+        Upload files in parallel sessions and commit them with one batch call.
+
+        :param files: [(filetype, file_result), ...]
+        :return: uploaded files
+        """
+        if len(files) == 1:
+            filetype, file_result = files[0]
+            self.upload(file_result, filetype)
+            return files
+        with ThreadPoolExecutor(max_workers=self.upload_workers) as executor:
+            entries = list(executor.map(self._try_upload_session, files))
+        # a failed session only drops its own file, the others are committed.
+        sessions = [(f, e) for f, e in zip(files, entries) if e is not None]
+        uploaded = []
+        for i in range(0, len(sessions), self.batch_limit):
+            chunk = sessions[i:i + self.batch_limit]
+            uploaded += [chunk[j][0] for j in self._finish_batch([e for f, e in chunk])]
+        return uploaded
+
+    def _data_path(self, name):
+        return '/data/{0}'.format(name)
+
+    def _read_data(self, name):
+        try:
+            meta, r = self.provider.files_download(self._data_path(name))
+            return r.content
+        except dropbox.exceptions.ApiError:
+            return None
+
+    def _write_data(self, name, payload: bytes):
+        self.provider.files_upload(f=payload, path=self._data_path(name),
+                                   mode=dropbox.dropbox_client.files.WriteMode.overwrite)
+
+    def _list_data(self, folder) -> list:
+        return [posixpath.basename(path) for path in self._list_folder_hashes(self._data_path(folder)).keys()]
+
+    def _delete_data(self, name):
+        try:
+            self.provider.files_delete_v2(self._data_path(name))
+        except dropbox.exceptions.ApiError:
+            pass
@@ -0,0 +1,135 @@
+import threading
+
+
+class HistoryView:
+    def __init__(self, base: set):
+        """
+        Staged view of one history set.
+        Lookups see the base set and local additions, additions stay local until merged.
+
+        :param base:
+        """
+        self.base = base
+        self.added = []
+        self._added = set()
+
+    def __contains__(self, item) -> bool:
+        return item in self.base or item in self._added
+
+    def __iter__(self):
+        yield from self.base
+        yield from self.added
+
+    def __len__(self) -> int:
+        return len(self.base) + len(self.added)
+
+    def append(self, item) -> None:
+        item = str(item)
+        if item not in self:
+            self.added.append(item)
+            self._added.add(item)
+
+
+class HistoryStore:
+    def __init__(self):
+        """
+        Append-only history journal with an in-memory set index.
+        A journal line is "source<TAB>kind<TAB>id".
+        Entries added after loading are kept in `pending` so only they need to be pushed.
+        """
+        self._index = {}
+        self._pending = []
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, source) -> bool:
+        return source in self._index
+
+    def _set(self, source: str, kind: str) -> set:
+        return self._index.setdefault(source, {}).setdefault(kind, set())
+
+    def _insert(self, source: str, kind: str, item_id: str) -> bool:
+        s = self._set(source, kind)
+        if item_id in s:
+            return False
+        s.add(item_id)
+        self._size += 1
+        return True
+
+    @property
+    def pending(self) -> list:
+        return list(self._pending)
+
+    def clear_pending(self, count: int = None) -> None:
+        """
+
+        :param count: clear only the first `count` entries, e.g. the ones already pushed. all when omitted.
+        """
+        with self._lock:
+            self._pending = [] if count is None else self._pending[count:]
+
+    def contains(self, source: str, kind: str, item_id) -> bool:
+        return str(item_id) in self._index.get(source, {}).get(kind, ())
+
+    def add(self, source: str, kind: str, item_id) -> None:
+        item_id = str(item_id)
+        with self._lock:
+            if self._insert(source, kind, item_id):
+                self._pending.append((source, kind, item_id))
+
+    def stage(self, source: str, kinds) -> dict:
+        """
+        Staged views for a scraper. Merge them back with `merge`.
+
+        :param source:
+        :param kinds:
+        :return: {kind: HistoryView}
+        """
+        with self._lock:
+            return {k: HistoryView(self._set(source, k)) for k in kinds}
+
+    def merge(self, source: str, staged: dict) -> None:
+        for kind, view in staged.items():
+            for item_id in getattr(view, 'added', view):
+                self.add(source, kind, item_id)
+
+    def load(self, journal: str) -> None:
+        with self._lock:
+            for line in journal.splitlines():
+                try:
+                    source, kind, item_id = line.split('\t')
+                except ValueError:
+                    continue
+                self._insert(source, kind, item_id)
+
+    def load_dict(self, data: dict) -> None:
+        """
+        Import the legacy history.yml layout {source: {kind: [id, ...]}}.
+        Imported entries are pending, so the next push writes them to the journal.
+
+        :param data:
+        :return:
+        """
+        for source, kinds in data.items():
+            if not isinstance(kinds, dict):
+                continue
+            for kind, ids in kinds.items():
+                for item_id in ids or []:
+                    self.add(source, kind, item_id)
+
+    def dump(self, entries=None) -> str:
+        """
+
+        :param entries: [(source, kind, id), ...]. every entry when omitted.
+        :return: journal text
+        """
+        if entries is None:
+            with self._lock:
+                entries = [(source, kind, item_id)
+                           for source, kinds in self._index.items()
+                           for kind, ids in kinds.items()
+                           for item_id in ids]
+        return ''.join('{0}\t{1}\t{2}\n'.format(*e) for e in entries)
@@ -4,6 +4,7 @@ import shutil
 from pathlib import Path
 
 from concierge.storage import Storage
+from concierge.storage.common import content_hash
 
 
 class LocalStorage(Storage):
@@ -15,7 +16,7 @@ class LocalStorage(Storage):
         super().__init__(storage_type, storage_token)
         self.provider = Path(Path(os.path.dirname(__file__)).parents[1])
         self.upload_path = Path(self.provider, 'downloads')
-        self.history_path = Path(self.provider, 'history.yml')
+        self.history_path = Path(self.provider, 'history')
 
     def connected(self):
         try:
@@ -24,17 +25,20 @@ class LocalStorage(Storage):
             return True
         return pathlib.Path.is_dir(self.upload_path)
 
+    def _destination(self, filetype, file_result):
+        return Path(self.upload_path, filetype, file_result['category'], '{0}{1}'
+                    .format(file_result['filename'], file_result['file_ext']))
+
+    def _remote_hash(self, filetype, file_result):
+        destination = self._destination(filetype, file_result)
+        if not os.path.isfile(destination):
+            return None
+        return content_hash(destination)
+
     def upload(self, file_result, filetype):
         if self.connected() and self._upload_path_safety_check(filetype, file_result['category']):
-            shutil.move(Path(file_result['path']),
-                        Path(self.upload_path, filetype, file_result['category'], '{0}{1}'
-                             .format(file_result['filename'], file_result['file_ext']))
-                        )
-
-    def _history_file_safety_check(self):
-        if not os.path.isfile(self.history_path):
-            with open(self.history_path, 'w'):
-                pass
+            self.metrics.count('bytes', os.path.getsize(file_result['path']), direction='out', host='local')
+            shutil.move(Path(file_result['path']), self._destination(filetype, file_result))
 
     def _upload_path_safety_check(self, upload_path, category):
         _p = Path(self.upload_path, upload_path, category)
@@ -44,12 +48,27 @@ class LocalStorage(Storage):
             return True
         return pathlib.Path.is_dir(_p)
 
-    def fetch_history(self):
-        if self.connected():
-            self._history_file_safety_check()
-            self.read_history(self.history_path)
+    def _read_data(self, name):
+        try:
+            with open(Path(self.provider, name), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write_data(self, name, payload: bytes):
+        path = Path(self.provider, name)
+        os.makedirs(path.parent, exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(payload)
+
+    def _list_data(self, folder) -> list:
+        try:
+            return os.listdir(Path(self.provider, folder))
+        except OSError:
+            return []
 
-    def push_history(self):
-        if self.connected():
-            with open(self.history_path, 'w') as f:
-                f.write(self.dump_history())
+    def _delete_data(self, name):
+        try:
+            os.remove(Path(self.provider, name))
+        except OSError:
+            pass
@@ -0,0 +1,88 @@
+import base64
+import hashlib
+import os
+
+_magic = b'PDFC2'
+_salt_size = 16
+_iterations = 100000
+
+
+def _fernet(passphrase: str, salt: bytes):
+    # imported here: cryptography is slow to import and only MK session reuse needs it.
+    from cryptography.fernet import Fernet
+    key = hashlib.pbkdf2_hmac('sha256', passphrase.encode('utf-8'), salt, _iterations, dklen=32)
+    return Fernet(base64.urlsafe_b64encode(key))
+
+
+def seal(passphrase: str, payload: bytes) -> bytes:
+    """
+    Fernet (AES-128-CBC and HMAC-SHA256) with a PBKDF2-SHA256 key derived from the passphrase.
+
+    :param passphrase:
+    :param payload:
+    :return: magic | salt | fernet token
+    """
+    salt = os.urandom(_salt_size)
+    return _magic + salt + _fernet(passphrase, salt).encrypt(payload)
+
+
+def unseal(passphrase: str, blob: bytes):
+    """
+
+    :param passphrase:
+    :param blob: output of `seal`.
+    :return: payload or None when the blob is damaged or the passphrase is wrong.
+    """
+    header = len(_magic) + _salt_size
+    if len(blob) <= header or not blob.startswith(_magic):
+        return None
+    from cryptography.fernet import InvalidToken
+    try:
+        return _fernet(passphrase, blob[len(_magic):header]).decrypt(blob[header:])
+    except InvalidToken:
+        return None
+
+
+class SecretStore:
+    def __init__(self, storage, name: str, passphrase: str):
+        """
+        One encrypted blob in the data area of a storage backend.
+
+        :param storage: Storage
+        :param name: data file name.
+        :param passphrase:
+        """
+        self.logger = storage.logger
+        self.storage = storage
+        self.name = name
+        self.passphrase = passphrase
+
+    def load(self):
+        """
+
+        :return: decrypted payload or None.
+        """
+        if not self.passphrase:
+            return None
+        try:
+            blob = self.storage._read_data(self.name)
+        except Exception:
+            self.logger.exception('{0} read failed.'.format(self.name))
+            return None
+        if not blob:
+            return None
+        payload = unseal(self.passphrase, blob)
+        if payload is None:
+            self.logger.info('{0} can not be decrypted. ignored.'.format(self.name))
+        return payload
+
+    def save(self, payload: bytes) -> None:
+        if not self.passphrase:
+            return
+        try:
+            self.storage._write_data(self.name, seal(self.passphrase, payload))
+        except Exception:
+            self.logger.exception('{0} write failed.'.format(self.name))
+
+    def clear(self) -> None:
+        self.storage._delete_data(self.name)
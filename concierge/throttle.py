@@ -0,0 +1,216 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from .config import env_int, env_float
+from .logger import get_logger
+from .metrics import get_metrics
+
+# priority lanes. a lower lane is served first when a host or the connection pool is busy.
+LISTING = 0
+PAGE = 1
+DOWNLOAD = 2
+
+lane_names = {LISTING: 'listing', PAGE: 'page', DOWNLOAD: 'download'}
+
+
+class _Gate:
+    def __init__(self, rate: float, burst: int, concurrency: int):
+        """
+        Token bucket and concurrency cap with prioritised waiters.
+
+        :param rate: requests per second. 0 means unlimited.
+        :param burst: bucket size.
+        :param concurrency: max holders at once. 0 means unlimited.
+        """
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.concurrency = concurrency
+        self.active = 0
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._waiting = []
+        self._cond = threading.Condition()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _ready(self, ticket: tuple):
+        """
+
+        :return: True when the ticket may go, else seconds to wait or None to wait for a release.
+        """
+        if self._waiting[0] != ticket or (self.concurrency and self.active >= self.concurrency):
+            return None
+        if self.rate <= 0:
+            return True
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return (1 - self._tokens) / self.rate
+
+    def acquire(self, ticket: tuple) -> None:
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    ready = self._ready(ticket)
+                    if ready is True:
+                        break
+                    self._cond.wait(ready)
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+            self.active += 1
+
+    def release(self) -> None:
+        with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+
+class _Bandwidth:
+    def __init__(self, rate: float, burst: float = 1.0):
+        """
+
+        :param rate: bytes per second.
+        :param burst: seconds of traffic allowed ahead of the rate.
+        """
+        self.rate = rate
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def consume(self, size: int, wait: bool = True) -> None:
+        """
+        Account `size` bytes. Waits until they fit the cap, or only records them when `wait` is False.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._next = max(self._next, now) + size / self.rate
+            delay = self._next - now - self.burst
+        if wait and delay > 0:
+            time.sleep(delay)
+
+
+def parse_host_limits(spec: str) -> dict:
+    """
+    "digest.mk.co.kr=2/4,bcaudio.co.kr=1" -> {host: (requests per second, concurrency or None)}
+    A limit applies to the host and its subdomains.
+    """
+    limits = {}
+    for part in (spec or '').split(','):
+        if '=' not in part:
+            continue
+        host, _, value = part.partition('=')
+        rate, _, concurrency = value.partition('/')
+        try:
+            limits[host.strip().lower()] = (float(rate), int(concurrency) if concurrency.strip() else None)
+        except ValueError:
+            continue
+    return limits
+
+
+class RequestScheduler:
+    def __init__(self, rate: float, burst: int, concurrency: int, max_connections: int = 0,
+                 bandwidth: float = 0, host_limits: dict = None):
+        """
+        Politeness control shared by every HttpClient in the process.
+        Each host has a token bucket and a concurrency cap, all requests share an optional
+        connection cap and an optional bandwidth cap. Waiters are served by lane, then in arrival order.
+
+        :param rate: default requests per second per host. 0 means unlimited.
+        :param burst: requests a host may get at once after being idle.
+        :param concurrency: default requests in flight per host. 0 means unlimited.
+        :param max_connections: requests in flight over all hosts. 0 means unlimited.
+        :param bandwidth: download bytes per second over all hosts. 0 means unlimited.
+        :param host_limits: {host: (rate, concurrency or None)} overrides.
+        """
+        self.logger = get_logger(__name__)
+        self.metrics = get_metrics()
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.host_limits = host_limits or {}
+        self._hosts = {}
+        self._lock = threading.Lock()
+        self._sequence = itertools.count()
+        self._global = _Gate(0, 1, max_connections)
+        self._bandwidth = _Bandwidth(bandwidth) if bandwidth > 0 else None
+
+    def _limits(self, host: str) -> tuple:
+        for name, (rate, concurrency) in self.host_limits.items():
+            if host == name or host.endswith('.' + name):
+                return rate, self.concurrency if concurrency is None else concurrency
+        return self.rate, self.concurrency
+
+    def _gate(self, host: str) -> _Gate:
+        with self._lock:
+            gate = self._hosts.get(host)
+            if gate is None:
+                rate, concurrency = self._limits(host)
+                gate = self._hosts[host] = _Gate(rate, self.burst, concurrency)
+            return gate
+
+    @contextmanager
+    def slot(self, host: str, lane: int = PAGE):
+        """
+        Hold a request slot of `host` for the block.
+
+        :param host:
+        :param lane: LISTING, PAGE or DOWNLOAD.
+        """
+        host = (host or '').lower()
+        gate = self._gate(host)
+        ticket = (lane, next(self._sequence))
+        start = time.perf_counter()
+        gate.acquire(ticket)
+        try:
+            self._global.acquire(ticket)
+        except BaseException:
+            gate.release()
+            raise
+        waited = time.perf_counter() - start
+        if waited >= 0.001:
+            self.metrics.observe('http_wait', waited, host=host, lane=lane_names.get(lane, lane))
+        try:
+            yield
+        finally:
+            self._global.release()
+            gate.release()
+
+    def transfer(self, size: int, lane: int = DOWNLOAD) -> None:
+        """
+        Account received bytes against the bandwidth cap.
+        Downloads wait for the cap, smaller lanes are only recorded so they are not held back.
+        """
+        if self._bandwidth:
+            self._bandwidth.consume(size, wait=lane >= DOWNLOAD)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def request_scheduler() -> RequestScheduler:
+    """
+    Process-wide scheduler configured by PDFC_HTTP_HOST_RATE, PDFC_HTTP_HOST_BURST,
+    PDFC_HTTP_HOST_CONCURRENCY, PDFC_HTTP_HOST_LIMITS, PDFC_HTTP_MAX_CONNECTIONS and PDFC_HTTP_BANDWIDTH.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler(rate=env_float('PDFC_HTTP_HOST_RATE', 10),
+                                          burst=env_int('PDFC_HTTP_HOST_BURST', 10),
+                                          concurrency=env_int('PDFC_HTTP_HOST_CONCURRENCY', 8),
+                                          max_connections=env_int('PDFC_HTTP_MAX_CONNECTIONS', 16),
+                                          bandwidth=env_float('PDFC_HTTP_BANDWIDTH', 0),
+                                          host_limits=parse_host_limits(os.environ.get('PDFC_HTTP_HOST_LIMITS')))
+        return _scheduler